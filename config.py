@@ -1,3 +1,4 @@
+from typing import get_origin
 from typing import Union
 
 from logger import debug
@@ -7,13 +8,18 @@ try:
     from orjson import (
         dumps as j_dumps,
         loads as j_loads,
+        OPT_APPEND_NEWLINE,
     )
+
+    _ORJSON = True
 except ImportError:
     from json import (
         dumps as j_dumps,
         loads as j_loads,
     )
 
+    _ORJSON = False
+
 import os
 
 __name__ = "ConfigModule"
@@ -21,6 +27,18 @@ __author__ = "RealistikDash"
 __version__ = "v2.0.0"
 
 
+def _dump_bytes_orjson(obj: Union[dict, list]) -> bytes:
+    return j_dumps(obj, option=OPT_APPEND_NEWLINE)
+
+
+def _dump_bytes_stdlib(obj: Union[dict, list]) -> bytes:
+    return (j_dumps(obj) + "\n").encode()
+
+
+# orjson already gives us bytes, so only the stdlib needs the extra encode.
+dump_bytes = _dump_bytes_orjson if _ORJSON else _dump_bytes_stdlib
+
+
 class JsonFile:
     """Assists within working with simple JSON files."""
 
@@ -42,7 +60,7 @@ class JsonFile:
     def load_file(self) -> None:
         """Reloads the file fully into memory."""
 
-        with open(self.file_name) as f:
+        with open(self.file_name, "rb") as f:
             self.file = j_loads(f.read())
 
     def get_file(self) -> dict:
@@ -61,11 +79,9 @@ class JsonFile:
                 within the file.
         """
 
-        with open(self.file_name, "w") as f:
-            json_content = j_dumps(
-                new_content
-            ).decode()  # TODO: This doesnt take indent arg?????
-            f.write(json_content)
+        # TODO: This doesnt take indent arg?????
+        with open(self.file_name, "wb") as f:
+            f.write(dump_bytes(new_content))
 
         self.file = new_content
 
@@ -98,13 +114,19 @@ class ConfigReader:
             # Read the key.
             key_val = cls.read_json(cls, var_name, default)
 
-            # Force it to be the sepcified type.
-            key_val = key_type(key_val)
+            # Force it to be the sepcified type. Generic aliases such as
+            # `list[str]` are coerced using their origin (`list`).
+            key_origin = get_origin(key_type) or key_type
+            if not isinstance(key_val, key_origin):
+                key_val = key_origin(key_val)
 
             # Set the attribute.
             setattr(cls, var_name, key_val)
 
         if cls.updated:
+            # Flush every new key to disk in a single write.
+            cls.json.write_file(cls.json.file)
+
             info(
                 "The config has just been updated! Please edit according to your preferences!"
             )
@@ -130,22 +152,21 @@ class ConfigReader:
             # Set it to an empty dict so it can be handled with the thing below.
             self.json.file = {}
 
+        file = self.json.file
+
         # Check if the key is present. If not, set it.
-        if key not in tuple(self.json.file):
+        if key not in file:
             # Set it so we can check if the key was modified.
             self.updated = True
             self.updated_keys.append(key)
             # Set the value in dict.
-            self.json.file[key] = default
-
-            # Write it to the file.
-            self.json.write_file(self.json.file)
+            file[key] = default
 
             # Return default
             return default
 
         # It exists, just return it.
-        return self.json.file[key]
+        return file[key]
 
 
 # TODO: Notifications for config updates.
@@ -158,6 +179,9 @@ class Config(ConfigReader):
     sql_user: str = "root"
     sql_db: str = "ripple"
     sql_password: str = ""
+    sql_pool_min: int = 4
+    sql_pool_max: int = 32
+    redis_pool_max: int = 32
 
     fokabot_key: str = ""
     osu_api_keys: list[str] = []
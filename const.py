@@ -1,4 +1,3 @@
-import re
 from enum import IntEnum
 from typing import Any
 from typing import Callable
@@ -26,7 +25,8 @@ def pymysql_encode(
 def escape_enum(
     val: Any, _: Optional[dict[object, object]] = None
 ) -> str:  # used for ^
-    return str(int(val))
+    # pymysql wants a str back, %d does the int conversion in one C call.
+    return "%d" % val
 
 
 @pymysql_encode(escape_enum)
@@ -54,10 +54,18 @@ class Status(IntEnum):
 
         if status <= 0:
             return Status.PENDING
-        return Status(status + 1)
+        return STATUS_BY_VAL[status + 1]
 
 
-LB_STATUSES = (Status.LOVED, Status.QUALIFIED, Status.APPROVED, Status.RANKED)
+# Direct value -> member lookups, skipping `EnumMeta.__call__` on hot paths.
+STATUS_BY_VAL: dict[int, Status] = Status._value2member_map_
+
+# Every osu!api v1 `approved` value (graveyard to loved) -> our status.
+STATUS_BY_API: dict[int, Status] = {api: Status.from_api(api) for api in range(-2, 5)}
+
+LB_STATUSES = frozenset(
+    (Status.LOVED, Status.QUALIFIED, Status.APPROVED, Status.RANKED)
+)
 
 
 class LeaderboardTypes(IntEnum):
@@ -70,6 +78,9 @@ class LeaderboardTypes(IntEnum):
     COUNTRY = 4  # Leaderboards containing only people from the user's nation.
 
 
+LB_TYPE_BY_VAL: dict[int, LeaderboardTypes] = LeaderboardTypes._value2member_map_
+
+
 @pymysql_encode(escape_enum)
 class Mode(IntEnum):
     VN_STANDARD = 0
@@ -88,18 +99,13 @@ class Mode(IntEnum):
     def as_mode_int(self) -> int:
         """Converts the mode enum to a mode int for storage in the db."""
 
-        val = self.value
-        if val == 7:
-            return 0
-        if val > 3:
-            val -= 4
-        return val
+        return _MODE_INT[self.value]
 
     @property
     def relax(self) -> bool:
         """Property stating whether the mode is a relax mode."""
 
-        return self.value > 3 and self.value != 7
+        return _RELAX[self.value]
 
     @property
     def autopilot(self) -> bool:
@@ -109,73 +115,64 @@ class Mode(IntEnum):
     def db_prefix(self) -> str:
         """Property stating the prefix for the mode in the db."""
 
-        mode_int = self.as_mode_int()
-
-        if mode_int == 0:
-            return "std"
-        elif mode_int == 1:
-            return "taiko"
-        elif mode_int == 2:
-            return "ctb"
-        elif mode_int == 3:
-            return "mania"
+        return _DB_PREFIX[self.value]
 
     @property
     def annouce_prefix(self) -> str:
-        mode_int = self.as_mode_int()
-
-        if mode_int == 0:
-            return "osu!"
-        elif mode_int == 1:
-            return "Taiko"
-        elif mode_int == 2:
-            return "Catch"
-        elif mode_int == 3:
-            return "Mania"
-        else:
-            raise NotImplementedError(f"Unknown mode int: {mode_int}")
+        return _ANNOUNCE_PREFIX[self.value]
 
     @staticmethod
     def from_mode_int(mode: int, mods: int) -> "Mode":
         """Converts a mode int and presence of rx/ap into a `Mode` enum."""
 
-        if mode == 3:
-            return Mode.VN_MANIA
-        if mods & 128:
-            mode += 4
-        if mods & 8192:
-            return Mode.AP_STANDARD
-        return Mode(mode)
+        return _MODE_FROM_INT[mode, mods & _MODE_MODS]
 
     @property
     def stats_table(self) -> str:
-        if self.autopilot:
-            return "ap_stats"
-
-        if self.relax:
-            return "rx_stats"
-
-        return "users_stats"
+        return _STATS_TABLE[self.value]
 
     @property
     def scores_table(self) -> str:
-        if self.autopilot:
-            return "scores_ap"
-
-        if self.relax:
-            return "scores_relax"
-
-        return "scores"
+        return _SCORES_TABLE[self.value]
 
     @property
     def leaderboard_str(self) -> str:
-        if self.autopilot:
-            return "autoboard"
-
-        if self.relax:
-            return "relaxboard"
-
-        return "leaderboard"
+        return _LEADERBOARD_STR[self.value]
+
+
+# Per-mode lookups, indexed by `Mode.value`. These are hit on pretty much
+# every request so we avoid branching on each access.
+_MODE_INT = (0, 1, 2, 3, 0, 1, 2, 0)
+_RELAX = (False, False, False, False, True, True, True, False)
+_DB_PREFIX = ("std", "taiko", "ctb", "mania", "std", "taiko", "ctb", "std")
+_ANNOUNCE_PREFIX = (
+    "osu!",
+    "Taiko",
+    "Catch",
+    "Mania",
+    "osu!",
+    "Taiko",
+    "Catch",
+    "osu!",
+)
+_STATS_TABLE = ("users_stats",) * 4 + ("rx_stats",) * 3 + ("ap_stats",)
+_SCORES_TABLE = ("scores",) * 4 + ("scores_relax",) * 3 + ("scores_ap",)
+_LEADERBOARD_STR = ("leaderboard",) * 4 + ("relaxboard",) * 3 + ("autoboard",)
+
+# (mode int, mods & (RX | AP)): Mode
+_MODE_MODS = 128 | 8192
+_MODE_FROM_INT: dict[tuple[int, int], Mode] = {}
+for _mode in range(4):
+    for _mods in (0, 128, 8192, _MODE_MODS):
+        if _mode == 3:
+            _MODE_FROM_INT[_mode, _mods] = Mode.VN_MANIA
+        elif _mods & 8192:
+            _MODE_FROM_INT[_mode, _mods] = Mode.AP_STANDARD
+        elif _mods & 128:
+            _MODE_FROM_INT[_mode, _mods] = Mode(_mode + 4)
+        else:
+            _MODE_FROM_INT[_mode, _mods] = Mode(_mode)
+del _mode, _mods
 
 
 FETCH_COL = (
@@ -187,6 +184,11 @@ FETCH_COL = (
 
 FETCH_TEXT = ("No Result", "Cache", "MySQL", "API")
 
+_FETCH_CONSOLE_TEXT = tuple(
+    f"{colour}{text}{Fore.RESET}{Fore.WHITE}"
+    for colour, text in zip(FETCH_COL, FETCH_TEXT)
+)
+
 
 class FetchResult(IntEnum):
     """Internal enum representing how a resource was fetched. Made mostly
@@ -213,18 +215,7 @@ class FetchResult(IntEnum):
     def console_text(self) -> str:
         """Returns the text string to be used in loggign."""
 
-        return f"{self.colour}{FETCH_TEXT[self.value]}{Fore.RESET}{Fore.WHITE}"
+        return _FETCH_CONSOLE_TEXT[self.value]
 
 
-MAP_FILENAME = re.compile(
-    r"^(?P<artist>.+) - (?P<title>.+) \((?P<mapper>.+)\) \[(?P<diff>.+)\]\.osu$"
-)
-
-
-class MapResult(IntEnum):
-    """Internal enum representing how a map was fetched. Made mostly
-    for logging purposes."""
-
-    UNSUBMITTED = 0  # No result
-    UPDATE_REQUIRED = 1  # Exists, not up to date on the client's end
-    EXISTS = 2  # No issues, unused
+FETCH_RESULT_BY_VAL: dict[int, FetchResult] = FetchResult._value2member_map_
@@ -1,4 +1,6 @@
 # Global caches that should be accessable everywhere.
+import aiomysql
+
 from .conn import conns
 from logger import info
 from objects.cache import BCryptCache
@@ -8,49 +10,91 @@ from objects.cache import FriendsCache
 from objects.cache import LRUCache
 from objects.cache import PrivilegeCache
 from objects.cache import StatsCache
+from objects.cache import UserInfoCache
 from objects.cache import WhitelistCache
 
 # -- Basic caches --
 beatmap = LRUCache(cache_length=120, cache_limit=1000)
+osu_file = LRUCache(cache_length=30, cache_limit=200)  # parsed .osu files
+pp_map = LRUCache(cache_length=30, cache_limit=200)  # parsed pp calc maps
 
 # -- Specialised Caches --
 clan = ClanCache()
-password = BCryptCache()
 priv = PrivilegeCache()
 country = CountryCache()
 friends = FriendsCache()
 whitelist = WhitelistCache()
 stats = StatsCache()
+user = UserInfoCache()
+# A fresh login may follow a rename or privilege change, so refetch their info.
+password = BCryptCache(on_login=user.remove)
 
 # Maps that obv dont exist. md5: Status
-no_check_md5s = {}
+# Expires so maps that get submitted/updated later are looked up again.
+no_check_md5s = LRUCache(cache_length=60, cache_limit=10000)
 
 # pp limits to cause auto-restrictions
 pp_caps = {}
 
 
+USER_BUNDLE_QUERY = (
+    "SELECT st.country, u.privileges FROM users u "
+    "LEFT JOIN users_stats st ON st.id = u.id WHERE u.id = %s"
+)
+# Its own result set rather than a GROUP_CONCAT column, which MySQL silently
+# truncates at `group_concat_max_len` (1024 bytes by default).
+USER_FRIENDS_QUERY = "SELECT user2 FROM users_relationships WHERE user1 = %s"
+
+
+async def cache_user_bundle(
+    user_id: int, cur: aiomysql.Cursor
+) -> tuple[str, set[int], int]:
+    """Caches the country, friends list and privileges of a user. The country
+    and privileges share a single query.
+
+    Returns:
+        A tuple of the user's country, friends list and privileges.
+    """
+
+    await cur.execute(USER_BUNDLE_QUERY, (user_id,))
+    country_db, priv_db = await cur.fetchone()
+
+    await cur.execute(USER_FRIENDS_QUERY, (user_id,))
+    user_friends = {friend_id for (friend_id,) in await cur.fetchall()}
+
+    user_country = country_db or "XX"
+
+    country.set(user_id, user_country)
+    friends.set(user_id, user_friends)
+    priv.set(user_id, priv_db)
+
+    return user_country, user_friends, priv_db
+
+
 async def init_caches():
-    """Pre-loads all the specialised caches with data for smooth operation."""
+    """Pre-loads the specialised caches that have to be complete before any
+    request is served, as a miss in them would wrongly restrict/skip users.
+
+    Countries are included as score submissions read them without a fallback,
+    so a miss would leave the user's country rank out of date.
+    """
 
     async with conns.sql.acquire() as conn:
         async with conn.cursor() as cur:
-            await clan.preload_all(cur)
-            info(f"Loaded clan cache with {clan.cached_count} cached entries!")
-
             await priv.preload_all(cur)
             info(f"Loaded privilege cache with {priv.cached_count} cached entries!")
 
-            await country.preload_all(cur)
-            info(f"Loaded country cache with {country.cached_count} cached entries!")
-
             await whitelist.preload_all(cur)
             info(
                 f"Loaded whitelist cache with {whitelist.cached_count} cached entries!"
             )
 
+            await country.preload_all(cur)
+            info(f"Loaded country cache with {country.cached_count} cached entries!")
+
             # too lazy to make an object for this, also unnecessary
             await cur.execute("SELECT * FROM pp_limits")
-            caps = await cur.fetchall()
+            caps = {row[0]: row for row in await cur.fetchall()}
 
             for mode in (
                 0,
@@ -58,7 +102,7 @@ async def init_caches():
                 2,
                 3,
             ):
-                cap = [row for row in caps if row[0] == mode][0]
+                cap = caps[mode]
                 pp_caps[mode] = {
                     "vn": cap[1],
                     "vnfl": cap[3],
@@ -69,3 +113,20 @@ async def init_caches():
                 }
 
             info(f"Loaded pp limits cache!")
+
+
+async def warm_caches():
+    """Pre-loads the specialised caches that are safe to be partially empty
+    for a while, meant to be ran in the background after startup.
+
+    A missing clan tag only affects how a name is displayed, and leaderboard
+    requests fill in friends on a miss.
+    """
+
+    async with conns.sql.acquire() as conn:
+        async with conn.cursor() as cur:
+            await clan.preload_all(cur)
+            info(f"Loaded clan cache with {clan.cached_count} cached entries!")
+
+            await friends.preload_all(cur)
+            info(f"Loaded friends cache with {friends.cached_count} cached entries!")
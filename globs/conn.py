@@ -1,9 +1,10 @@
+import asyncio
 import traceback
 from dataclasses import dataclass
-from dataclasses import field
 
+import aiohttp
 import aiomysql
-import aioredis
+from redis import asyncio as aioredis
 
 from config import conf
 from logger import error
@@ -11,16 +12,40 @@ from logger import info
 
 
 # Big botch.
-@dataclass
+@dataclass(init=False)
 class Connections:
-    sql: aiomysql.Pool = field(init=False)
-    redis: aioredis.Redis = field(init=False)
+    __slots__ = ("sql", "redis", "http")
+
+    sql: aiomysql.Pool
+    redis: aioredis.Redis
+    http: aiohttp.ClientSession
 
     async def establish(self) -> None:
         """Establishes all the required connections."""
 
-        self.sql = await create_sql_pool()
-        self.redis = await create_redis_pool()
+        self.sql, self.redis = await asyncio.gather(
+            create_sql_pool(),
+            create_redis_pool(),
+        )
+        self.http = create_http_session()
+
+    async def close(self) -> None:
+        """Closes the connections that need explicit cleanup."""
+
+        await self.http.close()
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """Creates the HTTP session shared by every outgoing request, keeping
+    connections to our internal services alive between requests."""
+
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=0,
+            keepalive_timeout=60,
+            ttl_dns_cache=300,  # osu! api lookups, the default is only 10s
+        ),
+    )
 
 
 async def create_redis_pool() -> aioredis.Redis:
@@ -29,7 +54,12 @@ async def create_redis_pool() -> aioredis.Redis:
     info("Attempting to connect to redis @ redis://localhost")
 
     try:
-        conn = aioredis.Redis(await aioredis.create_pool("redis://localhost"))
+        # hiredis is picked up automatically as the parser when installed.
+        conn = aioredis.from_url(
+            "redis://localhost",
+            max_connections=conf.redis_pool_max,
+        )
+        await conn.ping()
         info("Successfully connected to Redis!")
         return conn
     except Exception:
@@ -48,7 +78,11 @@ async def create_sql_pool() -> aiomysql.Pool:
             user=conf.sql_user,
             password=conf.sql_password,
             db=conf.sql_db,
-            pool_recycle=False,
+            minsize=conf.sql_pool_min,
+            maxsize=conf.sql_pool_max,
+            # Recycle before MySQL's `wait_timeout` silently drops idle conns.
+            pool_recycle=3600,
+            connect_timeout=5,
             autocommit=True,
         )
         info("Successfully connected to the database!")
@@ -1,23 +1,26 @@
+import asyncio
 import base64
-import copy
 import time
+from bisect import bisect_right
+from itertools import islice
+from operator import attrgetter
 from urllib.parse import unquote
-from urllib.parse import unquote_plus
 
 import aiohttp
-import aiomysql
-from aiohttp import ClientSession
 from starlette.requests import Request
 from starlette.responses import PlainTextResponse
 from starlette.responses import Response
 
 from const import FetchResult
+from const import LB_TYPE_BY_VAL
 from const import LeaderboardTypes
 from const import Mode
 from const import Status
 from globs import cache
 from globs.conn import conns
+from helpers.tasks import run_in_background
 from helpers.user import restrict_user
+from helpers.user import safe_name
 from logger import info
 from objects.beatmap import LWBeatmap
 from objects.beatmap import try_bmap
@@ -25,23 +28,6 @@ from objects.leaderboards import Leaderboard
 from objects.score import Score
 
 
-def __format_score_old(score: tuple, place: int, get_clans: bool = True) -> str:
-    """Formats a Database score tuple into a string format understood by the
-    client."""
-
-    name = score[12]
-    if get_clans:
-        if clan := cache.clan.get(score[13]):
-            name = f"[{clan}] " + name
-
-    return (
-        f"{score[0]}|{name}|{score[1]:.0f}|{score[2]}|{score[3]}|"
-        f"{score[4]}|{score[5]}|{score[6]}|{score[7]}|{score[8]}|"
-        f"{score[9]}|{score[10]}|{score[13]}|{place}|{score[11]}|"
-        "1"
-    )
-
-
 def __format_score(
     score: Score, rank: int, username: str, get_clans: bool = True
 ) -> str:
@@ -49,25 +35,23 @@ def __format_score(
         if clan := cache.clan.get(score.user_id):
             username = f"[{clan}] " + username
 
-    if score.mode > Mode.VN_MANIA:
-        displayed_score = int(score.pp)
-    else:
-        displayed_score = score.score
-
-    return (
-        f"{score.id}|{username}|{displayed_score}|{score.combo}|{score.n50}|{score.n100}|{score.n300}|{score.miss}|"
-        f"{score.katu}|{score.geki}|{int(score.fc)}|{int(score.mods)}|{score.user_id}|{rank}|{score.time}|"
-        "1"  # has replay
-    )
-
-
-async def __format_score_reg(
-    cur: aiomysql.Cursor, score: Score, rank: int, get_clans: bool = True
-):
-    await cur.execute("SELECT username FROM users WHERE id = %s", (score.user_id,))
-    username = (await cur.fetchone())[0]
+    # Everything but the name and rank stays the same for as long as the score
+    # lives in a cached leaderboard, so only build it once.
+    if score.lb_fmt is None:
+        if score.mode > Mode.VN_MANIA:
+            displayed_score = int(score.pp)
+        else:
+            displayed_score = score.score
+
+        score.lb_fmt = (
+            f"{score.id}|",
+            f"|{displayed_score}|{score.combo}|{score.n50}|{score.n100}|{score.n300}|{score.miss}|"
+            f"{score.katu}|{score.geki}|{int(score.fc)}|{int(score.mods)}|{score.user_id}|",
+            f"|{score.time}|1",  # has replay
+        )
 
-    return __format_score(score, rank, username, get_clans)
+    head, mid, tail = score.lb_fmt
+    return f"{head}{username}{mid}{rank}{tail}"
 
 
 def __beatmap_header(bmap: LWBeatmap, score_count: int = 0) -> str:
@@ -107,46 +91,22 @@ def error_lbs(msg: str) -> str:
     )
 
 
-PB_QUERY = """
-SELECT
-    s.id,
-    s.{scoring},
-    s.max_combo,
-    s.50_count,
-    s.100_count,
-    s.300_count,
-    s.misses_count,
-    s.katus_count,
-    s.gekis_count,
-    s.full_combo,
-    s.mods,
-    s.time,
-    a.username,
-    a.id,
-    s.pp
-FROM
-    {table} s
-INNER JOIN
-    users a on s.userid = a.id
-WHERE
-    a.id = %s AND
-    s.beatmap_md5 = %s AND
-    s.play_mode = %s AND
-    s.completed = 3
-LIMIT 1
-"""
-
-PB_PLACEMENT = """
-SELECT COUNT(*) + 1
-FROM {table} s
-INNER JOIN
-    users a on s.userid = a.id
-WHERE
-    s.completed = 3 AND
-    {scoring} > %s AND
-    s.beatmap_md5 = %s AND
-    s.play_mode = %s
-"""
+DUP_CHECK_QUERIES = {
+    mode: f"SELECT 1 FROM {mode.scores_table} WHERE checksum = %s" for mode in Mode
+}
+
+
+DONOR_PRIV = 4
+PREMIUM_PRIV = 8388608
+SCORE_LIMIT_PRIVS = DONOR_PRIV | PREMIUM_PRIV
+
+# Leaderboard size by the user's donor/premium bits. Donor takes precedence.
+SCORE_LIMITS = {
+    0: 150,  # normal user
+    DONOR_PRIV: 250,
+    PREMIUM_PRIV: 500,
+    SCORE_LIMIT_PRIVS: 250,
+}
 
 
 async def handle_leaderboards(request: Request) -> Response:
@@ -159,42 +119,36 @@ async def handle_leaderboards(request: Request) -> Response:
     mods = int(request.query_params["mods"])
     md5 = request.query_params["c"]
     mode_int = int(request.query_params["m"])
-    lb_type = LeaderboardTypes(int(request.query_params["v"]))
+    lb_type = LB_TYPE_BY_VAL[int(request.query_params["v"])]
 
     mode = Mode.from_mode_int(mode_int, mods)
 
-    safe_name = username.rstrip().lower().replace(" ", "_")
+    user_safe_name = safe_name(username)
 
     # Acquire conn.
     async with conns.sql.acquire() as conn:
         async with conn.cursor() as cur:
             # Handle authentication.
-            user_id = await cache.password.check_user(safe_name, password, cur)
+            user_id = await cache.password.check_user(user_safe_name, password, cur)
 
             if not user_id:
                 info(f"Received incorrect username + password combo from {username}.")
                 return PlainTextResponse("error: pass")
 
-            await cur.execute(
-                "SELECT country FROM users_stats WHERE id = %s",
-                (user_id,),
-            )
-
-            country_db = await cur.fetchone()
-            if not country_db:
-                country = "XX"
-            else:
-                country = country_db[0]
-
-            await cur.execute(
-                "SELECT user2 FROM users_relationships WHERE user1 = %s",
-                (user_id,),
-            )
+            country = cache.country.get(user_id)
+            friends = cache.friends.get(user_id)
+            user_priv = cache.priv.get(user_id)
 
-            f_db = await cur.fetchall()
-            friends_list = [uid for uid in f_db] + [user_id]
+            # Fill all of them in one go on a miss. This stays on the request's
+            # connection, taking a second one while holding this one could
+            # deadlock the pool under a burst of cold requests.
+            if country is None or friends is None or user_priv is None:
+                country, friends, user_priv = await cache.cache_user_bundle(
+                    user_id, cur
+                )
 
             result, beatmap = await try_bmap(md5, cur)
+
             if result == FetchResult.NONE:
                 return PlainTextResponse("-1|false")
 
@@ -207,9 +161,7 @@ async def handle_leaderboards(request: Request) -> Response:
             elif not beatmap.has_leaderboard:
                 return PlainTextResponse(f"{beatmap.status}|false")
 
-            lb = await Leaderboard.get_leaderboard(
-                beatmap, cur, unquote_plus(request.query_params["f"]), mode
-            )
+            lb = await Leaderboard.get_leaderboard(beatmap, cur, mode)
             if lb is None:
                 return PlainTextResponse("-1|false")
 
@@ -218,81 +170,66 @@ async def handle_leaderboards(request: Request) -> Response:
             if personal_best is None:
                 personal_fetch = FetchResult.NONE
 
-            user_priv = cache.priv.get(user_id)
-            if user_priv is None:
-                user_priv = await cache.priv.cache_individual(user_id, cur)
-                assert user_priv is not None
+            score_limit = SCORE_LIMITS[user_priv & SCORE_LIMIT_PRIVS]
 
-            scores: list[Score] = []
+            users_info = await cache.user.get_many(
+                {score.user_id for score in lb.scores}, cur
+            )
 
-            if user_priv & 4:  # donor
-                score_limit = 250
-            elif user_priv & 8388608:  # premium
-                score_limit = 500
-            else:  # normal user
-                score_limit = 150
+            def visible(score: Score) -> bool:
+                if not (score_user := users_info.get(score.user_id)):
+                    return False
 
-            for score in lb.scores:
-                if len(scores) >= score_limit:
-                    break
+                _, score_priv, user_country = score_user
 
-                await cur.execute(
-                    "SELECT privileges FROM users WHERE id = %s", (score.user_id,)
-                )
-                user_priv = (await cur.fetchone())[0]
-
-                await cur.execute(
-                    "SELECT country FROM users_stats WHERE id = %s", (score.user_id,)
-                )
-                user_country = (await cur.fetchone())[0]
-
-                if not user_priv & 1 and score.user_id != user_id:
-                    continue
+                if not score_priv & 1 and score.user_id != user_id:
+                    return False
 
                 if lb_type == LeaderboardTypes.MOD and score.mods != mods:
-                    continue
+                    return False
 
                 if lb_type == LeaderboardTypes.COUNTRY and user_country != country:
-                    continue
+                    return False
 
                 if (
                     lb_type == LeaderboardTypes.FRIENDS
-                    and score.user_id not in friends_list
+                    and score.user_id != user_id
+                    and score.user_id not in friends
                 ):
-                    continue
+                    return False
 
-                scores.append(score)
+                return True
 
-            scoring = "pp" if mode > Mode.VN_MANIA else "score"
+            # islice stops pulling as soon as the limit is hit.
+            scores: list[Score] = list(islice(filter(visible, lb.scores), score_limit))
+
+            if personal_best:
+                # scores is sorted descending, so negate to bisect for the
+                # first one below the pb.
+                scoring = attrgetter("pp" if mode > Mode.VN_MANIA else "score")
+                keys = [-scoring(score) for score in scores]
+                idx = bisect_right(keys, -scoring(personal_best["score"]))
+                if idx < len(keys):
+                    personal_best["rank"] = idx
+
+            # Build final response. Rows are encoded straight into one buffer
+            # rather than joining a list of strings and encoding the result.
+            resp = bytearray(__beatmap_header(beatmap, len(lb)).encode())
+            resp += b"\n"
             if personal_best:
+                resp += __format_score(
+                    personal_best["score"], personal_best["rank"], username, False
+                ).encode()
+
+            if beatmap.status.has_lb:
                 for idx, score in enumerate(scores):
-                    if getattr(score, scoring) < getattr(
-                        personal_best["score"], scoring
-                    ):
-                        personal_best["rank"] = idx
-                        break
-
-            # Build final response.
-            resp = "\n".join(
-                [
-                    __beatmap_header(beatmap, len(lb)),
-                    __format_score(
-                        personal_best["score"], personal_best["rank"], username, False
-                    )
-                    if personal_best
-                    else "",
-                    *(
-                        [
-                            await __format_score_reg(
-                                cur, score, idx + 1, score.user_id != user_id
-                            )
-                            for idx, score in enumerate(scores)
-                        ]
-                        if beatmap.status.has_lb
-                        else []
-                    ),
-                ]
-            ).encode()
+                    resp += b"\n"
+                    resp += __format_score(
+                        score,
+                        idx + 1,
+                        users_info[score.user_id][0],
+                        score.user_id != user_id,
+                    ).encode()
 
     time_taken = (time.time() - start_time) * 1000
     info(
@@ -300,7 +237,7 @@ async def handle_leaderboards(request: Request) -> Response:
         f" Served '{username}' ({user_id}) leaderboard for {beatmap.song_name} ({time_taken:.2f}ms)"
     )
 
-    return PlainTextResponse(resp)
+    return PlainTextResponse(bytes(resp))
 
 
 UNRANKED_MODS = 1 << 29 | 1 << 11 | 1 << 23  # score v2, auto, target
@@ -312,31 +249,59 @@ def pair_panel(name, before_val, after_val) -> str:
     return f"{name}Before:{before_val or ''}|{name}After:{after_val}"  # peppy why
 
 
+def chart_panel(
+    chart_id: str,
+    chart_url: str,
+    chart_name: str,
+    pairs: tuple[tuple[str, object, object], ...],
+    *extra: str,
+) -> str:
+    """Creates a chart panel string for use in score submission from
+    `(name, before, after)` pairs, followed by any `extra` fields."""
+
+    return "|".join(
+        (
+            f"chartId:{chart_id}",
+            f"chartUrl:{chart_url}",
+            f"chartName:{chart_name}",
+            *[pair_panel(name, before, after) for name, before, after in pairs],
+            *extra,
+        )
+    )
+
+
 from osupyparser.osr.osr_parser import ReplayFile
 from osupyparser.osr.constants import OsuReplayFrame
 
 from osupyparser.osu.osu_parser import OsuFile
 from osupyparser.osu.objects import HitObject, Slider, Spinner
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from itertools import accumulate
 
 
-def is_straight(x: list[float], y: list[float]) -> bool:
-    threshold = 1.0
-    is_straight_line = True
+def is_straight(x: list[float], y: list[float], threshold: float = 1.0) -> bool:
+    """Checks whether the cursor positions given roughly form a straight line,
+    comparing the slope of each segment against that of the first one."""
 
-    x = list(set([i for i in x if i > 0.0]))
-    y = list(set([i for i in y if i > 0.0]))
+    points = [(xval, yval) for xval, yval in zip(x, y) if xval > 0.0 and yval > 0.0]
+    if len(points) < 2:
+        return True
 
-    slope = (y[1] - y[0]) / (x[1] - x[0])
+    slope = None
+    prev_x, prev_y = points[0]
+    for xval, yval in points[1:]:
+        if xval == prev_x:  # no slope for a vertical step, skip it
+            continue
 
-    for i, (xval, yval) in enumerate(zip(x[2:], y[2:])):
-        s = (yval - y[i - 1]) / (xval - x[i - 1])
+        s = (yval - prev_y) / (xval - prev_x)
+        if slope is None:
+            slope = s
+        elif abs(s - slope) > threshold:
+            return False
 
-        if abs(s - slope) > threshold:
-            is_straight_line = False
-            break
+        prev_x, prev_y = xval, yval
 
-    return is_straight_line
+    return True
 
 
 @dataclass
@@ -344,6 +309,14 @@ class Play:
     replay: ReplayFile
     map: OsuFile
 
+    # Absolute time of each of the first 1000 frames, computed once.
+    frame_times: list[int] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.frame_times = list(
+            accumulate(frame.delta for frame in self.replay.frames[:1000])
+        )
+
     def get_movements_between_objects(
         self,
         object1: HitObject,
@@ -352,16 +325,13 @@ class Play:
         earliest_time = object1.start_time
         latest_time = object2.start_time
 
-        frames: list[OsuReplayFrame] = []
-
-        for idx, frame in enumerate(self.replay.frames[:1000]):
-            previous_frames = self.replay.frames[:idx] if idx > 0 else [frame]
-
-            frame_time = sum(prev.delta for prev in previous_frames) + frame.delta
-            if latest_time >= frame_time >= earliest_time:
-                frames.append(frame)
-
-        return frames
+        # Deltas may be negative so the times are not guaranteed to be sorted,
+        # hence a linear scan rather than a bisect.
+        return [
+            frame
+            for frame, frame_time in zip(self.replay.frames, self.frame_times)
+            if latest_time >= frame_time >= earliest_time
+        ]
 
     @property
     def is_chattered(self) -> bool:
@@ -383,45 +353,77 @@ class Play:
         return is_chatter
 
 
+def load_osu_file(beatmap_id: int) -> OsuFile:
+    """Reads and parses a beatmap's .osu file from disk."""
+
+    osu_file = OsuFile(f"/home/akatsuki/lets/.data/beatmaps/{beatmap_id}.osu")
+    osu_file.parse_file()
+
+    return osu_file
+
+
+def detect_chatter(replay_bytes: bytes, osu_file: OsuFile) -> bool:
+    """Parses the replay, returning whether it looks chattered on the map."""
+
+    replay = ReplayFile.from_bytes(replay_bytes, pure_lzma=True)
+
+    return Play(replay, osu_file).is_chattered
+
+
 async def chatter_check(replay_id: int, scores_table: str) -> None:
     """Automatically detects if a replay is using chatter plugin"""
 
+    # Only the player and the map's .osu id are needed, the user id is already
+    # on the score so there's no need to go through the users table.
     async with conns.sql.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
+        async with conn.cursor() as cur:
             await cur.execute(
-                f"SELECT * FROM {scores_table} WHERE id = %s", (replay_id,)
+                f"SELECT s.userid, b.beatmap_id FROM {scores_table} s "
+                "INNER JOIN beatmaps b ON b.beatmap_md5 = s.beatmap_md5 "
+                "WHERE s.id = %s",
+                (replay_id,),
             )
-            score = await cur.fetchone()
+            row = await cur.fetchone()
 
-            await cur.execute("SELECT * FROM users WHERE id = %s", (score["userid"],))
-            user = await cur.fetchone()
+    if not row:
+        return
 
-            await cur.execute(
-                "SELECT * FROM beatmaps WHERE beatmap_md5 = %s", (score["beatmap_md5"],)
-            )
-            bmap = await cur.fetchone()
+    user_id, beatmap_id = row
 
-    async with ClientSession() as session:
-        async with session.get(f"http://localhost:8484/get?id={replay_id}") as session:
-            if not session or session.status != 200:
-                return
+    async with conns.http.get(f"http://localhost:8484/get?id={replay_id}") as resp:
+        if not resp or resp.status != 200:
+            return
 
-            replay_bytes = await session.read()
+        replay_bytes = await resp.read()
 
-    replay = ReplayFile.from_bytes(replay_bytes, pure_lzma=True)
-    osu_file = OsuFile(f"/home/akatsuki/lets/.data/beatmaps/{bmap['beatmap_id']}.osu")
-    osu_file.parse_file()
+    # Decoding, parsing and the check itself are all blocking, keep them off
+    # the event loop.
+    loop = asyncio.get_running_loop()
 
-    play = Play(replay, osu_file)
+    # Play only reads the map, so parsed ones can be shared between replays.
+    if not (osu_file := cache.osu_file.get(beatmap_id)):
+        osu_file = await loop.run_in_executor(None, load_osu_file, beatmap_id)
+        cache.osu_file.cache(beatmap_id, osu_file)
 
-    if play.is_chattered:
+    if await loop.run_in_executor(None, detect_chatter, replay_bytes, osu_file):
         replay_url = f"https://akatsuki.pw/web/replays/{replay_id}"
         await restrict_user(
-            user["id"],
+            user_id,
             f"Restricted by auto chatter detection. Please check this replay: {replay_url}",
         )
 
 
+async def __save_replay(score_id: int, replay: bytes) -> None:
+    """Sends a submitted replay to the replay storage service."""
+
+    async with conns.http.post(
+        f"http://localhost:3030/save?id={score_id}",
+        data=replay,
+        timeout=aiohttp.ClientTimeout(total=5),
+    ):
+        pass
+
+
 async def handle_submission(request: Request) -> Response:
     """Handles the submission endpoint."""
 
@@ -441,6 +443,10 @@ async def handle_submission(request: Request) -> Response:
             elif score.mods & UNRANKED_MODS:
                 return PlainTextResponse("error: no")
 
+            # Bound once, these are looked up all over the submission path.
+            mode = score.mode
+            mode_int = mode.as_mode_int()
+
             # if not headers.get("Token"):
             #     await restrict_user(
             #         score.user_id, "Restricted for missing token header"
@@ -448,20 +454,15 @@ async def handle_submission(request: Request) -> Response:
 
             fs_data = args["fs"]
             try:
-                decoded = base64.b64decode(fs_data).decode(errors="ignore")
-
-                if (
-                    decoded[8] == "-"
-                    and decoded[13] == "-"
-                    and decoded[18] == "-"
-                    and decoded[23] == "-"
-                    and len(decoded) == 36
-                ):
-                    score.using_patcher = True
-                else:
-                    score.using_patcher = False
-            except Exception:
-                score.using_patcher = False
+                decoded = base64.b64decode(fs_data)
+            except ValueError:  # binascii.Error or non-ascii str
+                decoded = b""
+
+            # The patcher sends a UUID, check for its dashes at byte level (0x2D).
+            score.using_patcher = (
+                len(decoded) == 36
+                and decoded[8] == decoded[13] == decoded[18] == decoded[23] == 0x2D
+            )
 
             if headers.get("User-Agent") != "osu!":
                 await restrict_user(score.user_id, "Restricted for User-Agent != osu!")
@@ -472,10 +473,7 @@ async def handle_submission(request: Request) -> Response:
                         score.user_id, "Restricted for 'i' screenshot file on score sub"
                     )
 
-            table = score.mode.scores_table
-            await cur.execute(
-                f"SELECT 1 FROM {table} WHERE checksum = %s", (score.checksum,)
-            )
+            await cur.execute(DUP_CHECK_QUERIES[mode], (score.checksum,))
 
             if await cur.fetchone():
                 score.status = -1  # duplicate
@@ -490,13 +488,13 @@ async def handle_submission(request: Request) -> Response:
                 score.passed
                 and score.map.gives_pp
                 and not cache.whitelist.get(
-                    score.user_id, score.mode.relax or score.mode.autopilot
+                    score.user_id, mode.relax or mode.autopilot
                 )  # TODO: sep rx/ap whitelist
                 and cache.priv.get(score.user_id) & 1
             ):
-                if score.mode.relax:
+                if mode.relax:
                     cap = "rx"
-                elif score.mode.autopilot:
+                elif mode.autopilot:
                     cap = "ap"
                 else:
                     cap = "vn"
@@ -504,21 +502,23 @@ async def handle_submission(request: Request) -> Response:
                 if score.mods & 1 << 10:
                     cap += "fl"
 
-                pp_cap = cache.pp_caps[score.mode.as_mode_int()][cap]
+                pp_cap = cache.pp_caps[mode_int][cap]
 
                 if int(score.pp) >= pp_cap:
                     await restrict_user(
                         score.user_id,
-                        f"Restricted for surpassing {'Relax' if score.mode.relax else ('Vanilla' if not score.mode.autopilot else 'Autopilot')} pp cap ({score.pp:.2f}pp)",
+                        f"Restricted for surpassing {'Relax' if mode.relax else ('Vanilla' if not mode.autopilot else 'Autopilot')} pp cap ({score.pp:.2f}pp)",
                     )
 
-            leaderboard = await Leaderboard.get_leaderboard(
-                score.map, cur, "", score.mode
-            )
-            previous_score = leaderboard.find_user_score(score.user_id)
-            if previous_score:
-                score.previous_score = previous_score["score"]
-                score.previous_score.rank = previous_score["rank"]
+            # Failed/quit scores never touch the leaderboard or the panel
+            # diffs, so there's no point materializing it for them.
+            leaderboard = None
+            if score.passed:
+                leaderboard = await Leaderboard.get_leaderboard(score.map, cur, mode)
+                previous_score = leaderboard.find_user_score(score.user_id)
+                if previous_score:
+                    score.previous_score = previous_score["score"]
+                    score.previous_score.rank = previous_score["rank"]
 
             await score.submit(cur)
 
@@ -528,40 +528,55 @@ async def handle_submission(request: Request) -> Response:
                 (
                     score.user_id,
                     score.map.md5,
-                    1 if score.mode.relax else (2 if score.mode.autopilot else 0),
-                    score.mode.as_mode_int(),
+                    1 if mode.relax else (2 if mode.autopilot else 0),
+                    mode_int,
                 ),
             )
 
+            replay_save = None
             if score.passed:
+                # Posted as bytes, py3.9's SpooledTemporaryFile isn't an
+                # io.IOBase so aiohttp can't send the upload file itself.
                 replay = await args.getlist("score")[1].read()
-                # print(replay)
                 if not replay or replay == b"\r\n":
                     await restrict_user(
                         score.user_id, "Restricted for missing/invalid replay file"
                     )
 
-                async with ClientSession(
-                    timeout=aiohttp.ClientTimeout(total=5)
-                ) as session:
-                    await session.post(
-                        f"http://localhost:3030/save?id={score.id}", data=replay
-                    )
+                # Upload it while we get on with the db work below.
+                replay_save = asyncio.create_task(__save_replay(score.id, replay))
 
-            await score.map.increment_counts(cur)
+            try:
+                await score.map.increment_counts(cur)
+
+                stats = await cache.stats.get(score.user_id, mode, cur)
+            finally:
+                # Awaited even if the above raises, so the upload is never left
+                # running on its own with its exception unseen.
+                if replay_save is not None:
+                    await replay_save
 
-            stats = await cache.stats.get(score.user_id, score.mode, cur)
             if not stats:
                 info(f"{score.user_name} has no stats?")
                 return PlainTextResponse("")  # try resubmission
 
-            old_stats = copy.copy(stats)
+            # Only these are needed for the panel diffs, no need to copy it all.
+            old_rank, old_ranked_score, old_total_score = (
+                stats.rank,
+                stats.ranked_score,
+                stats.total_score,
+            )
+            old_max_combo, old_accuracy, old_pp = (
+                stats.max_combo,
+                stats.accuracy,
+                stats.pp,
+            )
 
             stats.playcount += 1
             stats.total_score += score.score
             stats.total_hits += score.n300 + score.n100 + score.n50
 
-            if score.mode.as_mode_int() in (1, 3):
+            if mode_int in (1, 3):
                 # taiko uses geki & katu for hitting big notes with 2 keys
                 # mania uses geki & katu for rainbow 300 & 200
                 stats.total_hits += score.geki + score.katu
@@ -608,13 +623,11 @@ async def handle_submission(request: Request) -> Response:
         panels = []
         new_achievements = []  # TODO
 
-        await stats.refresh_stats()
-        if (
-            score.passed
-            and old_stats.pp != stats.pp
-            and cache.priv.get(score.user_id) & 1
-        ):
-            await stats.update_rank()
+        # Neither is needed for the response so don't make the client wait.
+        if score.passed and old_pp != stats.pp and cache.priv.get(score.user_id) & 1:
+            run_in_background(stats.update_rank())  # also refreshes stats
+        else:
+            run_in_background(stats.refresh_stats())
 
         panels.append(
             f"beatmapId:{score.map.id}|"
@@ -624,104 +637,68 @@ async def handle_submission(request: Request) -> Response:
             f"approvedDate:{score.map.formatted_time}"
         )
 
-        failed_not_prev_panel = (
-            (
-                pair_panel("rank", "0", score.rank),
-                pair_panel("maxCombo", "", score.combo),
-                pair_panel("accuracy", "", round(score.acc, 2)),
-                pair_panel("rankedScore", "", score.score),
-                pair_panel("pp", "", score.pp),
-            )
-            if score.passed
-            else (
-                pair_panel("rank", "0", "0"),
-                pair_panel("maxCombo", "", score.combo),
-                pair_panel("accuracy", "", ""),
-                pair_panel("rankedScore", "", score.score),
-                pair_panel("pp", "", ""),
-            )
-        )
-
         if score.map.has_leaderboard:
+            prev = score.previous_score
+            if prev and score.passed:
+                beatmap_pairs = (
+                    ("rank", prev.rank, score.rank),
+                    ("maxCombo", prev.combo, score.combo),
+                    ("accuracy", round(prev.acc, 2), round(score.acc, 2)),
+                    ("rankedScore", prev.score, score.score),
+                    ("pp", round(prev.pp), round(score.pp)),
+                )
+            elif score.passed:
+                beatmap_pairs = (
+                    ("rank", "0", score.rank),
+                    ("maxCombo", "", score.combo),
+                    ("accuracy", "", round(score.acc, 2)),
+                    ("rankedScore", "", score.score),
+                    ("pp", "", score.pp),
+                )
+            else:
+                beatmap_pairs = (
+                    ("rank", "0", "0"),
+                    ("maxCombo", "", score.combo),
+                    ("accuracy", "", ""),
+                    ("rankedScore", "", score.score),
+                    ("pp", "", ""),
+                )
+
             # Beatmap ranking panel.
             panels.append(
-                "|".join(
-                    (
-                        "chartId:beatmap",
-                        f"chartUrl:{score.map.url}",
-                        "chartName:Beatmap Ranking",
-                        *(
-                            failed_not_prev_panel
-                            if not score.previous_score or not score.passed
-                            else (
-                                pair_panel(
-                                    "rank", score.previous_score.rank, score.rank
-                                ),
-                                pair_panel(
-                                    "maxCombo", score.previous_score.combo, score.combo
-                                ),
-                                pair_panel(
-                                    "accuracy",
-                                    round(score.previous_score.acc, 2),
-                                    round(score.acc, 2),
-                                ),
-                                pair_panel(
-                                    "rankedScore",
-                                    score.previous_score.score,
-                                    score.score,
-                                ),
-                                pair_panel(
-                                    "pp",
-                                    round(score.previous_score.pp),
-                                    round(score.pp),
-                                ),
-                            )
-                        ),
-                        f"onlineScoreId:{score.id}",
-                    )
+                chart_panel(
+                    "beatmap",
+                    score.map.url,
+                    "Beatmap Ranking",
+                    beatmap_pairs,
+                    f"onlineScoreId:{score.id}",
                 )
             )
 
         panels.append(
-            "|".join(
+            chart_panel(
+                "overall",
+                f"https://akatsuki.pw/u/{score.user_id}",
+                "Global Ranking",
                 (
-                    "chartId:overall",
-                    f"chartUrl:https://akatsuki.pw/u/{score.user_id}",
-                    "chartName:Global Ranking",
-                    *(
-                        (
-                            pair_panel("rank", old_stats.rank, stats.rank),
-                            pair_panel(
-                                "rankedScore",
-                                old_stats.ranked_score,
-                                stats.ranked_score,
-                            ),
-                            pair_panel(
-                                "totalScore", old_stats.total_score, stats.total_score
-                            ),
-                            pair_panel(
-                                "maxCombo", old_stats.max_combo, stats.max_combo
-                            ),
-                            pair_panel(
-                                "accuracy",
-                                round(old_stats.accuracy, 2),
-                                round(stats.accuracy, 2),
-                            ),
-                            pair_panel("pp", round(old_stats.pp), round(stats.pp)),
-                        )
-                    ),
-                    f"achievements-new:{'/'.join(new_achievements)}",
-                    f"onlineScoreId:{score.id}",
-                )
+                    ("rank", old_rank, stats.rank),
+                    ("rankedScore", old_ranked_score, stats.ranked_score),
+                    ("totalScore", old_total_score, stats.total_score),
+                    ("maxCombo", old_max_combo, stats.max_combo),
+                    ("accuracy", round(old_accuracy, 2), round(stats.accuracy, 2)),
+                    ("pp", round(old_pp), round(stats.pp)),
+                ),
+                f"achievements-new:{'/'.join(new_achievements)}",
+                f"onlineScoreId:{score.id}",
             )
         )
 
         info(
-            f"{score.user_name} submitted a {score.pp:,.2f}pp score on {score.map!r} ({score.mode.name} | id: {score.id} | completed: {score.status})"
+            f"{score.user_name} submitted a {score.pp:,.2f}pp score on {score.map!r} ({mode.name} | id: {score.id} | completed: {score.status})"
         )
 
-        # if score.mode.as_mode_int() == 0 and score.status > 1:
-        # asyncio.ensure_future(chatter_check(score.id, table))
+        # if mode_int == 0 and score.status > 1:
+        # asyncio.ensure_future(chatter_check(score.id, mode.scores_table))
 
         return PlainTextResponse("\n".join(panels))
 
@@ -732,12 +709,12 @@ async def handle_replays(request: Request) -> Response:
     password = request.query_params["h"]
     replay_id = int(request.query_params["c"])
 
-    safe_name = username.rstrip().lower().replace(" ", "_")
+    user_safe_name = safe_name(username)
 
     async with conns.sql.acquire() as conn:
         async with conn.cursor() as cur:
             # Handle authentication.
-            user_id = await cache.password.check_user(safe_name, password, cur)
+            user_id = await cache.password.check_user(user_safe_name, password, cur)
 
             if not user_id:
                 info(f"Received incorrect username + password combo from {username}.")
@@ -775,11 +752,10 @@ async def handle_replays(request: Request) -> Response:
                     [replay_data[2]],
                 )
 
-            async with ClientSession() as session:
-                async with session.get(
-                    f"http://localhost:3030/get?id={replay_id}"
-                ) as session:
-                    if not session or session.status != 200:
-                        return PlainTextResponse("")
+            async with conns.http.get(
+                f"http://localhost:3030/get?id={replay_id}"
+            ) as resp:
+                if resp.status != 200:
+                    return PlainTextResponse("")
 
-                    return Response(await session.read())
+                return Response(await resp.read())
@@ -0,0 +1,51 @@
+import asyncio
+import traceback
+from typing import Coroutine
+from typing import Optional
+
+from logger import error
+
+# At most this many run at once, the rest wait their turn, so a burst of
+# submissions can't flood redis/mysql with side work.
+MAX_RUNNING_TASKS = 64
+# Past this many outstanding (running + waiting), new ones are dropped rather
+# than piling up without bound.
+MAX_PENDING_TASKS = 1024
+
+# Strong references to running tasks, as the loop only keeps weak ones.
+_BACKGROUND_TASKS: set[asyncio.Task] = set()
+
+# Made on first use, on py3.9 a semaphore binds to the loop current when it's
+# created, and uvicorn only makes its loop once it starts.
+_RUNNING: Optional[asyncio.Semaphore] = None
+
+
+async def _run_logged(coro: Coroutine) -> None:
+    async with _RUNNING:
+        try:
+            await coro
+        except Exception:
+            error("Exception occured in background task! " + traceback.format_exc())
+
+
+def run_in_background(coro: Coroutine) -> Optional[asyncio.Task]:
+    """Schedules `coro` to run without awaiting it, logging any exception
+    it raises. Meant for side effects the response does not depend on.
+
+    Returns `None` and drops `coro` if too many are already outstanding."""
+
+    global _RUNNING
+
+    if len(_BACKGROUND_TASKS) >= MAX_PENDING_TASKS:
+        error(f"Too many background tasks outstanding! Dropping {coro.__qualname__}.")
+        coro.close()
+        return None
+
+    if _RUNNING is None:
+        _RUNNING = asyncio.Semaphore(MAX_RUNNING_TASKS)
+
+    task = asyncio.get_running_loop().create_task(_run_logged(coro))
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+    return task
@@ -1,24 +1,31 @@
 import time
+from functools import lru_cache
 
 from globs import cache
 from globs.conn import conns
 from logger import formatted_date
 
 
+@lru_cache(maxsize=8192)
+def safe_name(username: str) -> str:
+    """Returns the username in Ripple's 'safe' format. Memoised, as the same
+    users log in and submit over and over."""
+
+    return username.rstrip().lower().replace(" ", "_")
+
+
 async def restrict_user(user_id: int, reason: str = "") -> None:
     """Restricts a user and notifies pep.py"""
 
     async with conns.sql.acquire() as conn:
         async with conn.cursor() as cur:
-            privilege = cache.priv.get(user_id)
-            if not privilege:
-                privilege = await cache.priv.cache_individual(user_id, cur)
-
             await cur.execute(
-                "SELECT username, notes FROM users WHERE id = %s", (user_id,)
+                "SELECT u.username, u.notes, u.privileges, st.country FROM users u "
+                "LEFT JOIN users_stats st ON st.id = u.id WHERE u.id = %s",
+                (user_id,),
             )
-            data = await cur.fetchone()
-            old_notes = data[1]
+            username, old_notes, privilege, country = await cur.fetchone()
+            country = (country or "xx").lower()
             notes = (old_notes or "") + f"\n[{formatted_date()}] {reason}"
 
             new_priv = privilege & ~1  # remove user_public
@@ -32,26 +39,26 @@ async def restrict_user(user_id: int, reason: str = "") -> None:
                 "VALUES (NULL, %s, %s, UNIX_TIMESTAMP(), %s)",
                 (
                     999,
-                    f'has restricted {data[0]} for the following reason: "{reason}"',
+                    f'has restricted {username} for the following reason: "{reason}"',
                     "Aika",
                 ),
             )
-            await cache.priv.cache_individual(user_id, cur)  # update in cache
+            cache.priv.set(user_id, new_priv)  # update in cache
+            cache.user.remove(user_id)
 
-            await cur.execute(
-                "SELECT country FROM users_stats WHERE id = %s", (user_id,)
-            )
-            country = (await cur.fetchone())[0].lower()
+    # Send it all to redis in a single round-trip.
+    pipe = conns.redis.pipeline(transaction=False)
 
     uid = str(user_id)
     for mode in ("std", "taiko", "ctb", "mania"):
-        await conns.redis.zrem(f"ripple:leaderboard:{mode}", uid)
-        await conns.redis.zrem(f"ripple:leaderboard_relax:{mode}", uid)
+        pipe.zrem(f"ripple:leaderboard:{mode}", uid)
+        pipe.zrem(f"ripple:leaderboard_relax:{mode}", uid)
 
         if country != "xx":
-            await conns.redis.zrem(f"ripple:leaderboard:{mode}:{country}", uid)
-            await conns.redis.zrem(f"ripple:leaderboard_relax:{mode}:{country}", uid)
+            pipe.zrem(f"ripple:leaderboard:{mode}:{country}", uid)
+            pipe.zrem(f"ripple:leaderboard_relax:{mode}:{country}", uid)
 
-    await conns.redis.publish(
+    pipe.publish(
         "peppy:ban", user_id
     )  # our subscriber will pick this up alongside bancho
+    await pipe.execute()
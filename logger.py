@@ -57,9 +57,12 @@ def custom_log(message: str, header: str, colour: Ansi) -> None:
     log_message(message, header, f"\033[{colour}m")
 
 
-def debug(message: str) -> None:
+def debug(message: str, *args) -> None:
+    """Logs a debug message if running in debug mode. `args` are %-formatted
+    into `message` only when it is, saving the work otherwise."""
+
     if DEBUG:
-        log_message(message, "DEBUG", "\033[43m")
+        log_message(message % args if args else message, "DEBUG", "\033[43m")
 
 
 def info(message: str) -> None:
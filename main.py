@@ -1,28 +1,43 @@
 #!/usr/bin/env python3.9
+import asyncio
+
 import uvicorn
 from starlette.applications import Starlette
 from starlette.routing import Route
 
 from config import conf
 from globs.cache import init_caches
+from globs.cache import warm_caches
 from globs.conn import conns
 from handlers import handle_leaderboards
 from handlers import handle_replays
 from handlers import handle_submission
+from helpers.tasks import run_in_background
 from logger import DEBUG
 from logger import debug
 from logger import error
 from logger import info
+from objects.pp import shutdown_pp_pool
 from pubsubs import handle_status_update
 from pubsubs import pubsub_executor
 
-# uvloop is a significantly faster loop.
+# uvloop is a significantly faster loop, and httptools a faster parser. Both
+# are handed to uvicorn rather than installed here, as it sets up its own loop.
 try:
-    import uvloop
+    import uvloop  # noqa: F401
 
-    uvloop.install()
+    UVICORN_LOOP = "uvloop"
 except ImportError:
     error("Not using uvloop! Performance may be degraded.")
+    UVICORN_LOOP = "asyncio"
+
+try:
+    import httptools  # noqa: F401
+
+    UVICORN_HTTP = "httptools"
+except ImportError:
+    error("Not using httptools! Performance may be degraded.")
+    UVICORN_HTTP = "h11"
 
 __version__ = "0.0.2"
 
@@ -37,20 +52,26 @@ REDIS_PUBSUB = (
 async def create_pubsub_listeners() -> None:
     """Creates listeners for redis pub events."""
 
-    for name, handler in REDIS_PUBSUB:
-        await pubsub_executor(name, handler)
-        debug(f"Subscribed to Redis event {name}")
+    # All of them share the one connection.
+    await pubsub_executor(dict(REDIS_PUBSUB))
+    for name, _ in REDIS_PUBSUB:
+        debug("Subscribed to Redis event %s", name)
 
     info(f"Created {len(REDIS_PUBSUB)} Redis Listeners.")
 
 
-PRERUN_TASKS = (conns.establish, init_caches, create_pubsub_listeners)
+# Ran concurrently once the connections are up, as they all depend on them.
+PRERUN_TASKS = (init_caches, create_pubsub_listeners)
 
 
 async def execute_all_tasks() -> None:
     """Runs all of the pre-run tasks."""
-    for task in PRERUN_TASKS:
-        await task()
+
+    await conns.establish()
+    await asyncio.gather(*(task() for task in PRERUN_TASKS))
+
+    # Not needed to start serving, so don't hold startup back for them.
+    run_in_background(warm_caches())
 
 
 def main() -> int:
@@ -59,6 +80,7 @@ def main() -> int:
     app = Starlette(
         debug=DEBUG,
         on_startup=[execute_all_tasks],
+        on_shutdown=[conns.close, shutdown_pp_pool],
         routes=[
             Route(
                 "/web/osu-submit-modular-selector.php",
@@ -69,7 +91,13 @@ def main() -> int:
             Route("/web/osu-osz2-getscores.php", handle_leaderboards),
         ],
     )
-    uvicorn.run(app, uds=conf.http_sock, access_log=False)
+    uvicorn.run(
+        app,
+        uds=conf.http_sock,
+        access_log=False,
+        loop=UVICORN_LOOP,
+        http=UVICORN_HTTP,
+    )
     # TODO: may be worth tinkering further with gzip level
     # app = Server(name="Acachesuki", max_conns=15, gzip=7)
 
@@ -1,21 +1,27 @@
-import random
+import asyncio
+import time
 import traceback
 from dataclasses import dataclass
 from dataclasses import field
 from datetime import datetime
-from datetime import timedelta
+from functools import cached_property
+from itertools import cycle
 from typing import Optional
 from typing import TYPE_CHECKING
 from typing import Union
 
-import aiohttp
 import aiomysql  # For type checking
+from yarl import URL
 
 from config import conf
+from const import FETCH_RESULT_BY_VAL
 from const import FetchResult
 from const import Mode
 from const import Status
+from const import STATUS_BY_API
+from const import STATUS_BY_VAL
 from globs import cache
+from globs.conn import conns
 from logger import debug
 from logger import error
 
@@ -30,7 +36,14 @@ except ImportError:
 UPDATE_CHECK_TIME = 432000  # 5 Days in seconds
 UPDATE_SKIP_STATUSES = (Status.RANKED, Status.APPROVED)
 
-json_dump = lambda data: str(json_lib.dumps(data))
+# Round-robin the api keys so their rate limits are spread evenly.
+_API_KEYS = cycle(conf.osu_api_keys)
+if not conf.osu_api_keys:
+    error("No osu!api keys set in config.json! Maps can't be fetched from the api.")
+BMAP_API_URL = URL("https://old.ppy.sh/api/get_beatmaps")  # parsed once
+
+# md5: in-progress mirror fetch, shared by concurrent requests for the same map.
+_MIRROR_FETCHES: dict[str, asyncio.Task] = {}
 
 SQL_BMAP_FETCH_QUERY = (
     "SELECT beatmap_id, beatmapset_id, beatmap_md5, ranked, "
@@ -49,10 +62,16 @@ async def get_bmap(md5: str) -> Union[dict, str]:
     """Creates a request to Akatsuki's oapi bmap mirror (http://akat.fumos.live/get_map)
     and returns the json response."""
 
-    async with aiohttp.ClientSession(json_serialize=json_dump) as s:
-        key = random.choice(conf.osu_api_keys)
-        async with s.get(f"https://old.ppy.sh/api/get_beatmaps?h={md5}&k={key}") as r:
-            return (await r.json(content_type=None))[0]  # NOTE: may raise exc
+    # An empty cycle would raise StopIteration, which a coroutine turns into
+    # a confusing RuntimeError.
+    if not conf.osu_api_keys:
+        raise ValueError("No osu!api keys set in config.json (osu_api_keys).")
+
+    async with conns.http.get(
+        BMAP_API_URL, params={"h": md5, "k": next(_API_KEYS)}
+    ) as r:
+        # Straight from the body's bytes, orjson doesn't need it decoded first.
+        return json_lib.loads(await r.read())[0]  # NOTE: may raise exc
 
 
 @dataclass
@@ -82,13 +101,13 @@ class LWBeatmap:
         if self.frozen:
             return False
 
-        # Linear time scaling from gulag.
-        now = datetime.now()
-        update_delta = now - self.last_updated
+        # Linear time scaling from gulag, done on epoch floats rather than
+        # building datetimes/timedeltas on every leaderboard request.
+        now = time.time()
+        last_updated = self.ts
+        days = (now - last_updated) // 86400
 
-        check_delta = timedelta(hours=2 + ((5 / 365) * update_delta.days))
-
-        return now > (self.last_updated + check_delta)
+        return now > last_updated + 3600 * (2 + (5 / 365) * days)
 
     @property
     def has_leaderboard(self) -> bool:
@@ -106,11 +125,13 @@ class LWBeatmap:
     def ts(self) -> float:
         return self.last_updated.timestamp()
 
-    @property
+    # The ids and name never change for an instance (updates replace it), so
+    # these are only built once.
+    @cached_property
     def url(self) -> str:
         return f"https://osu.ppy.sh/beatmapsets/{self.set_id}#osu/{self.id}"
 
-    @property
+    @cached_property
     def embed(self) -> str:
         return f"[{self.url} {self.song_name}]"
 
@@ -119,7 +140,7 @@ class LWBeatmap:
 
         cache.beatmap.cache(self.md5, self)
 
-        debug(f"Cached beatmap {self.song_name} to the global beatmap cache.")
+        debug("Cached beatmap %s to the global beatmap cache.", self.song_name)
 
     async def save(self, cur: aiomysql.Cursor) -> None:
         """Adds the current beatmap object into the database, updating if it already exists"""
@@ -142,7 +163,7 @@ class LWBeatmap:
             ),
         )
 
-        debug(f"Saved beatmap {self.song_name} to the database.")
+        debug("Saved beatmap %s to the database.", self.song_name)
 
     # Staticmethods
     @staticmethod
@@ -151,7 +172,7 @@ class LWBeatmap:
         global cache. If not already cached, returns `None`."""
 
         if bmap := cache.beatmap.get(md5):
-            debug(f"Retrieved beatmap {bmap.song_name} from cache!")
+            debug("Retrieved beatmap %s from cache!", bmap.song_name)
 
         return bmap
 
@@ -160,7 +181,7 @@ class LWBeatmap:
         """Attmepts to create an instance of `LWBeatmap` using data acquired
         from the MySQL database. If does not exist in the database, returns `None`."""
 
-        await cur.execute(SQL_BMAP_FETCH_QUERY, md5)
+        await cur.execute(SQL_BMAP_FETCH_QUERY, (md5,))
         bmap_db = await cur.fetchone()
 
         if not bmap_db:
@@ -170,7 +191,7 @@ class LWBeatmap:
             id=bmap_db[0],
             set_id=bmap_db[1],
             md5=bmap_db[2],
-            status=Status(bmap_db[3]),
+            status=STATUS_BY_VAL[bmap_db[3]],
             song_name=bmap_db[4],
             rating=bmap_db[5],
             last_updated=datetime.fromtimestamp(bmap_db[6]),
@@ -188,10 +209,11 @@ class LWBeatmap:
             id=int(resp["beatmap_id"]),
             set_id=int(resp["beatmapset_id"]),
             md5=resp["file_md5"],
-            status=Status.from_api(int(resp["approved"])),
+            status=STATUS_BY_API[int(resp["approved"])],
             song_name=create_song_name(resp["artist"], resp["title"], resp["version"]),
             rating=10,
-            last_updated=datetime.strptime(resp["last_update"], "%Y-%m-%d %H:%M:%S"),
+            # "%Y-%m-%d %H:%M:%S" is valid iso, this skips strptime's format parsing.
+            last_updated=datetime.fromisoformat(resp["last_update"]),
             frozen=False,
             playcount=0,
             passcount=0,
@@ -200,8 +222,22 @@ class LWBeatmap:
     @staticmethod
     async def from_akat_mirror(md5: str) -> Optional["LWBeatmap"]:
         """Attempts to create an instance of `LWBeatmap` from Akatsuki's osu!api
-        beatmap mirror. Returns `None` if not found."""
+        beatmap mirror. Returns `None` if not found.
+
+        Concurrent calls for the same md5 (e.g. a popular map dropping out of
+        cache) share a single request rather than each sending their own.
+        """
+
+        if not (fetch := _MIRROR_FETCHES.get(md5)):
+            fetch = asyncio.create_task(LWBeatmap._fetch_akat_mirror(md5))
+            fetch.add_done_callback(lambda _: _MIRROR_FETCHES.pop(md5, None))
+            _MIRROR_FETCHES[md5] = fetch
 
+        # Shielded so one request going away doesn't cancel it for the others.
+        return await asyncio.shield(fetch)
+
+    @staticmethod
+    async def _fetch_akat_mirror(md5: str) -> Optional["LWBeatmap"]:
         try:
             resp = await get_bmap(md5)
         except IndexError:
@@ -215,7 +251,7 @@ class LWBeatmap:
             return None
 
         if not resp or isinstance(resp, str):
-            debug(f"Beatmap {md5} does not exist on the osu!api!")
+            debug("Beatmap %s does not exist on the osu!api!", md5)
             return None
 
         return LWBeatmap.from_oapiv1_dict(resp)
@@ -232,7 +268,7 @@ class LWBeatmap:
             (self.playcount, self.passcount, self.md5),
         )
 
-        debug(f"Incremented playcount and passcount of {self.song_name}.")
+        debug("Incremented playcount and passcount of %s.", self.song_name)
 
     @staticmethod
     def blank_with_status(st: Status) -> "LWBeatmap":
@@ -255,9 +291,6 @@ class LWBeatmap:
         return f"{self.song_name} ({self.md5})"
 
 
-UPDATE_BMAP = LWBeatmap.blank_with_status(Status.UPDATE_AVAILABLE)
-NOT_SUB_BMAP = LWBeatmap.blank_with_status(Status.NOT_SUBMITTED)
-
 # Big mess im tired.
 async def try_bmap(
     md5: str, cur: aiomysql.Cursor
@@ -265,12 +298,10 @@ async def try_bmap(
     """Attempts to fetch the beatmap from multiple sources, ordered by
     speed. Handles updates and ensures the correct object is fetched."""
 
-    if st := cache.no_check_md5s.get(md5):
-        debug(f"The MD5 {md5} is on the no check list. It will not be fetched.")
-        if st == Status.UPDATE_AVAILABLE:
-            return (FetchResult.NONE, UPDATE_BMAP)
-        else:
-            return (FetchResult.NONE, NOT_SUB_BMAP)
+    # Same result as when it was first added, the reason stays in the list.
+    if cache.no_check_md5s.get(md5):
+        debug("The MD5 %s is on the no check list. It will not be fetched.", md5)
+        return (FetchResult.NONE, None)
 
     # Cache is fastest.
     bmap = LWBeatmap.from_cache(md5)
@@ -283,31 +314,35 @@ async def try_bmap(
             res += 1
             bmap = await LWBeatmap.from_akat_mirror(md5)
 
+            # Only maps new to us need writing back, ones from the db are
+            # already there as-is.
+            if bmap is not None:
+                await bmap.save(cur)
+
         if bmap is not None:
-            await bmap.save(cur)
             bmap.cache()
 
     # If the beatmap was not found from all sources, give up.
     if not bmap:
-        debug(f"Added {md5} to no check list. It will not be looked up.")
-        cache.no_check_md5s[md5] = Status.NOT_SUBMITTED
+        debug("Added %s to no check list. It will not be looked up.", md5)
+        cache.no_check_md5s.cache(md5, Status.NOT_SUBMITTED)
         return (FetchResult.NONE, None)
 
-    if bmap.status == Status.UPDATE_AVAILABLE:
-        cache.no_check_md5s[md5] = Status.UPDATE_AVAILABLE
-        debug(f"Added {md5} to no check list. It will not be looked up.")
+    if bmap.status is Status.UPDATE_AVAILABLE:
+        cache.no_check_md5s.cache(md5, Status.UPDATE_AVAILABLE)
+        debug("Added %s to no check list. It will not be looked up.", md5)
         return (FetchResult.NONE, None)
 
     # Check if we need to try to update.
     if bmap.deserves_update:
-        debug(f"Checking for updates for {bmap!r}")
+        debug("Checking for updates for %r", bmap)
 
         current_data = await LWBeatmap.from_akat_mirror(md5)
         if current_data:
             bmap.last_updated = datetime.now()
 
             if current_data.md5 != bmap.md5:
-                debug(f"Updating {bmap!r}")
+                debug("Updating %r", bmap)
                 bmap = current_data
 
                 bmap.cache()
@@ -315,4 +350,4 @@ async def try_bmap(
 
                 res += 1
 
-    return FetchResult(res), bmap
+    return FETCH_RESULT_BY_VAL[res], bmap
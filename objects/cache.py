@@ -1,8 +1,10 @@
 # Structures related to caching etc.
 import asyncio
 import time
+from collections import deque
+from collections import OrderedDict
+from typing import Callable
 from typing import Optional
-from typing import TypedDict
 from typing import Union
 
 import aiomysql
@@ -14,9 +16,8 @@ from objects.stats import Stats
 CACHE_KEY = Union[int, str, tuple]
 
 
-class CachedObject(TypedDict):
-    expire: int
-    object: object
+# (expire, object), a tuple rather than a dict per entry.
+CachedObject = tuple[int, object]
 
 
 class LRUCache:  # generic class
@@ -30,10 +31,13 @@ class LRUCache:  # generic class
             cache_limit (int): A limit to how many objects can be max cached
                 before other objects start being removed.
         """
-        self._cache: dict[CACHE_KEY, CachedObject] = {}  # The main cache object.
-        self.length = (
-            cache_length * 60
-        )  # Multipled by 60 to get the length in seconds rather than minutes.
+        # The main cache object, ordered from least to most recently used.
+        self._cache: OrderedDict[CACHE_KEY, CachedObject] = OrderedDict()
+        # (expire, key) in the order they were cached, so in expiry order.
+        self._expiry: deque[tuple[int, CACHE_KEY]] = deque()
+        # The length in nanoseconds rather than minutes, as expiry is kept in
+        # `time.monotonic_ns()` ticks (no float round trip, no clock jumps).
+        self.length_ns = cache_length * 60 * 1_000_000_000
         self._cache_limit = cache_limit
 
     @property
@@ -47,24 +51,23 @@ class LRUCache:  # generic class
 
     def cache(self, key: CACHE_KEY, cache_obj: object) -> None:
         """Adds an object to the cache."""
-        self._cache[key] = {
-            "expire": int(time.time()) + self.length,
-            "object": cache_obj,
-        }
-        self.run_checks()
+        current_timestamp = time.monotonic_ns()
+        expire = current_timestamp + self.length_ns
+        self._cache[key] = (expire, cache_obj)
+        self._cache.move_to_end(key)
+        self._expiry.append((expire, key))
+        self.run_checks(current_timestamp)
 
     def remove_cache(self, key: CACHE_KEY) -> None:
         """Removes an object from cache."""
-        try:
-            del self._cache[key]
-        except KeyError:
-            # It doesnt matter if it fails. All that matters is that no such object exist and if it doesnt exist in the first place, that's already objective complete.
-            pass
+        # It doesnt matter if it's not there, all that matters is that it isn't after.
+        self._cache.pop(key, None)
 
     def get_lb_caches(self, identifier: CACHE_KEY) -> list:
         caches = []
 
-        for key in self._get_cached_keys():
+        # Only collects keys, so the dict can be walked directly.
+        for key in self._cache:
             if len(key) < 3:
                 continue
             if key[:2] == identifier:
@@ -86,68 +89,63 @@ class LRUCache:  # generic class
         curr_obj = self._cache.get(key)
 
         if curr_obj is not None:
-            return curr_obj["object"]
+            self._cache.move_to_end(key)
+            return curr_obj[1]
 
     def remove_all_elements(self, pattern: str) -> None:
         # remove all tuple entries with this as a starter
+        keys = [
+            key for key in self._cache if isinstance(key, tuple) and key[0] == pattern
+        ]
+        for key in keys:
+            self.remove_cache(key)
 
-        for key in self._get_cached_keys():
-            if isinstance(key, tuple) and key[0] == pattern:
-                self.remove_cache(key)
-
-    def _get_cached_keys(self) -> tuple[CACHE_KEY, ...]:
-        """Returns a list of all cache keys currently cached."""
-        return tuple(self._cache)
-
-    def _get_expired_cache(self) -> list:
-        """Returns a list of expired cache keys."""
-        current_timestamp = int(time.time())
+    def _get_expired_cache(self, current_timestamp: int) -> list:
+        """Returns a list of expired cache keys, dropping them from the expiry
+        queue. Only the expired front of the queue is looked at."""
         expired = []
-        for key in self._get_cached_keys():
-            # We dont want to use get as that  will soon have the ability to make its own objects, slowing this down.
-            if self._cache[key]["expire"] < current_timestamp:
-                # This cache is expired.
+        while self._expiry and self._expiry[0][0] < current_timestamp:
+            expire, key = self._expiry.popleft()
+            # Skip keys that have since been removed or cached again.
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == expire:
                 expired.append(key)
         return expired
 
-    def _remove_expired_cache(self) -> None:
+    def _remove_expired_cache(self, current_timestamp: int) -> None:
         """Removes all of the expired cache."""
-        for key in self._get_expired_cache():
+        for key in self._get_expired_cache(current_timestamp):
             self.remove_cache(key)
 
     def _remove_limit_cache(self) -> None:
         """Removes all objects past limit if cache reached its limit."""
 
-        # Calculate how much objects we have to throw away.
-        throw_away_count = len(self._get_cached_keys()) - self._cache_limit
-
-        if not throw_away_count:
-            # No levels to throw away
-            return
+        # Throw away the least recently used until we're back at the limit.
+        while len(self._cache) > self._cache_limit:
+            self._cache.popitem(last=False)
 
-        # Get x oldest ids to remove.
-        throw_away_ids = self._get_cached_keys()[:throw_away_count]
-        for key in throw_away_ids:
-            self.remove_cache(key)
+    def run_checks(self, current_timestamp: Optional[int] = None) -> None:
+        """Runs checks on the cache, only sweeping when there's anything to
+        remove. `cache()` passes in the timestamp it already took."""
+        if current_timestamp is None:
+            current_timestamp = time.monotonic_ns()
 
-    def run_checks(self) -> None:
-        """Runs checks on the cache."""
-        self._remove_expired_cache()
-        self._remove_limit_cache()
+        if self._expiry and self._expiry[0][0] < current_timestamp:
+            self._remove_expired_cache(current_timestamp)
+        if len(self._cache) > self._cache_limit:
+            self._remove_limit_cache()
 
     def get_all_items(self):
         """Generator that lists all of the objects currently cached."""
 
-        # return [obj["object"] for _, obj in self._cache.items()]
-
         # Make it a generator for performance.
         for obj in self._cache.values():
-            yield obj["object"]
+            yield obj[1]
 
     def get_all_keys(self):
         """Generator that returns all keys of the keys to the cache."""
 
-        return self._get_cached_keys()
+        return tuple(self._cache)
 
 
 class AsyncLRUCache:  # generic class
@@ -161,10 +159,13 @@ class AsyncLRUCache:  # generic class
             cache_limit (int): A limit to how many objects can be max cached
                 before other objects start being removed.
         """
-        self._cache: dict[CACHE_KEY, CachedObject] = {}  # The main cache object.
-        self.length = (
-            cache_length * 60
-        )  # Multipled by 60 to get the length in seconds rather than minutes.
+        # The main cache object, ordered from least to most recently used.
+        self._cache: OrderedDict[CACHE_KEY, CachedObject] = OrderedDict()
+        # (expire, key) in the order they were cached, so in expiry order.
+        self._expiry: deque[tuple[int, CACHE_KEY]] = deque()
+        # The length in nanoseconds rather than minutes, as expiry is kept in
+        # `time.monotonic_ns()` ticks (no float round trip, no clock jumps).
+        self.length_ns = cache_length * 60 * 1_000_000_000
         self._cache_limit = cache_limit
         self._lock = asyncio.Lock()
 
@@ -179,28 +180,24 @@ class AsyncLRUCache:  # generic class
 
     def cache(self, key: CACHE_KEY, cache_obj: object) -> None:
         """Adds an object to the cache."""
-        self._cache[key] = {
-            "expire": int(time.time()) + self.length,
-            "object": cache_obj,
-        }
-        self.run_checks()
+        current_timestamp = time.monotonic_ns()
+        expire = current_timestamp + self.length_ns
+        self._cache[key] = (expire, cache_obj)
+        self._cache.move_to_end(key)
+        self._expiry.append((expire, key))
+        self.run_checks(current_timestamp)
 
-    async def remove_cache(self, key: CACHE_KEY, lock: bool = True) -> None:
-        """Removes an object from cache."""
-        if lock:
-            await self._lock.acquire()
-        try:
-            del self._cache[key]
-        except KeyError:
-            # It doesnt matter if it fails. All that matters is that no such object exist and if it doesnt exist in the first place, that's already objective complete.
-            pass
-        finally:
-            self._lock.release()
+    def remove_cache(self, key: CACHE_KEY) -> None:
+        """Removes an object from cache. A single delete needs no lock, the
+        bulk removals that want one hold it around their own loop."""
+        # It doesnt matter if it's not there, all that matters is that it isn't after.
+        self._cache.pop(key, None)
 
     def get_lb_caches(self, identifier: CACHE_KEY) -> list:
         caches = []
 
-        for key in self._get_cached_keys():
+        # Only collects keys, so the dict can be walked directly.
+        for key in self._cache:
             if len(key) < 3:
                 continue
             if key[:2] == identifier:
@@ -214,83 +211,80 @@ class AsyncLRUCache:  # generic class
         async with self._lock:
             caches = self.get_lb_caches(identifier)
             for cache in caches:
-                self.remove_cache(cache, False)
+                self.remove_cache(cache)
 
-    async def get(self, key: CACHE_KEY) -> Optional[object]:
-        """Retrieves a cached object from cache."""
+    def get(self, key: CACHE_KEY) -> Optional[object]:
+        """Retrieves a cached object from cache. Doesn't take the lock, as a
+        lookup can't be interleaved with anything without an await in it."""
 
         # Try to get it from cache.
-        async with self._lock:
-            curr_obj = self._cache.get(key)
+        curr_obj = self._cache.get(key)
 
-            if curr_obj is not None:
-                return curr_obj["object"]
+        if curr_obj is not None:
+            self._cache.move_to_end(key)
+            return curr_obj[1]
 
     async def remove_all_elements(self, pattern: str) -> None:
         # remove all tuple entries with this as a starter
 
         async with self._lock:
-            for key in self._get_cached_keys():
-                if isinstance(key, tuple) and key[0] == pattern:
-                    self.remove_cache(key, False)
-
-    def _get_cached_keys(self) -> tuple[CACHE_KEY, ...]:
-        """Returns a list of all cache keys currently cached."""
-        return tuple(self._cache)
+            keys = [
+                key
+                for key in self._cache
+                if isinstance(key, tuple) and key[0] == pattern
+            ]
+            for key in keys:
+                self.remove_cache(key)
 
-    def _get_expired_cache(self) -> list:
-        """Returns a list of expired cache keys."""
-        current_timestamp = int(time.time())
+    def _get_expired_cache(self, current_timestamp: int) -> list:
+        """Returns a list of expired cache keys, dropping them from the expiry
+        queue. Only the expired front of the queue is looked at."""
         expired = []
-        for key in self._get_cached_keys():
-            # We dont want to use get as that  will soon have the ability to make its own objects, slowing this down.
-            if self._cache[key]["expire"] < current_timestamp:
-                # This cache is expired.
+        while self._expiry and self._expiry[0][0] < current_timestamp:
+            expire, key = self._expiry.popleft()
+            # Skip keys that have since been removed or cached again.
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == expire:
                 expired.append(key)
         return expired
 
-    async def _remove_expired_cache(self) -> None:
+    # These never await, so they're sync and ran as-is from `run_checks`.
+    def _remove_expired_cache(self, current_timestamp: int) -> None:
         """Removes all of the expired cache."""
 
-        async with self._lock:
-            for key in self._get_expired_cache():
-                self.remove_cache(key, False)
+        for key in self._get_expired_cache(current_timestamp):
+            self.remove_cache(key)
 
-    async def _remove_limit_cache(self) -> None:
+    def _remove_limit_cache(self) -> None:
         """Removes all objects past limit if cache reached its limit."""
 
-        async with self._lock:
-            # Calculate how much objects we have to throw away.
-            throw_away_count = len(self._get_cached_keys()) - self._cache_limit
+        # Throw away the least recently used until we're back at the limit.
+        while len(self._cache) > self._cache_limit:
+            self._cache.popitem(last=False)
 
-            if not throw_away_count:
-                # No levels to throw away
-                return
+    def run_checks(self, current_timestamp: Optional[int] = None) -> None:
+        """Runs checks on the cache, only sweeping when there's anything to
+        remove. `cache()` passes in the timestamp it already took."""
+        if current_timestamp is None:
+            current_timestamp = time.monotonic_ns()
 
-            # Get x oldest ids to remove.
-            throw_away_ids = self._get_cached_keys()[:throw_away_count]
-            for key in throw_away_ids:
-                self.remove_cache(key)
-
-    def run_checks(self) -> None:
-        """Runs checks on the cache."""
-        self._remove_expired_cache()
-        self._remove_limit_cache()
+        if self._expiry and self._expiry[0][0] < current_timestamp:
+            self._remove_expired_cache(current_timestamp)
+        if len(self._cache) > self._cache_limit:
+            self._remove_limit_cache()
 
     async def get_all_items(self):
         """Generator that lists all of the objects currently cached."""
 
-        # return [obj["object"] for _, obj in self._cache.items()]
-
         # Make it a generator for performance.
         async with self._lock:
             for obj in self._cache.values():
-                yield obj["object"]
+                yield obj[1]
 
     def get_all_keys(self):
         """Generator that returns all keys of the keys to the cache."""
 
-        return self._get_cached_keys()
+        return tuple(self._cache)
 
 
 class ClanCache:
@@ -302,17 +296,14 @@ class ClanCache:
     async def preload_all(self, cur: aiomysql.Cursor) -> None:
         """Loads all clan tags for users."""
 
-        self._cache.clear()
-
         # Grab all clan memberships from db.
         await cur.execute(
             "SELECT u.id, c.tag FROM users u " "INNER JOIN clans c ON u.clan_id = c.id"
         )
         clans_db = await cur.fetchall()
 
-        # Save all to cache.
-        for u, tag in clans_db:
-            self._cache[u] = tag
+        # Swapped in whole once loaded, built in C rather than a Python loop.
+        self._cache = dict(clans_db)
 
     def get(self, user_id: int) -> Optional[str]:
         """Returns the clan tag for the given user.
@@ -332,10 +323,7 @@ class ClanCache:
         """
 
         # Delete them if they already had a value cached.
-        try:
-            del self._cache[user_id]
-        except KeyError:
-            pass
+        self._cache.pop(user_id, None)
 
         # Grab their tag.
         await cur.execute(
@@ -362,9 +350,16 @@ class ClanCache:
 class BCryptCache:
     """A cache for storing known password md5s to speed up the auth process."""
 
-    def __init__(self) -> None:
+    def __init__(self, on_login: Optional[Callable[[int], None]] = None) -> None:
+        """Establishes the cache.
+        Args:
+            on_login (Callable[[int], None]): Called with the user id whenever
+                a login is verified against the database rather than the
+                cache, letting other caches drop what they hold for the user.
+        """
         # safe_username: (user_id, known_md5)
         self._cache: dict[str, tuple[int, str]] = {}
+        self._on_login = on_login
 
     async def check_user(
         self, safe_name: str, pw_md5: str, cur: aiomysql.Cursor
@@ -399,9 +394,14 @@ class BCryptCache:
             return 0
 
         # Bcrypt check (MAY TAKE UP TO 300ms! This is why we cache it in the first place)
-        if bcrypt.checkpw(pw_md5.encode(), res_db[1].encode()):
+        # Ran in a thread as bcrypt releases the GIL, so it doesn't stall the loop.
+        if await asyncio.get_running_loop().run_in_executor(
+            None, bcrypt.checkpw, pw_md5.encode(), res_db[1].encode()
+        ):
             # Great success! Cache it now.
             self._cache[safe_name] = (res_db[0], pw_md5)
+            if self._on_login is not None:
+                self._on_login(res_db[0])
             return res_db[0]
 
         return 0
@@ -416,15 +416,12 @@ class PrivilegeCache:
     async def preload_all(self, cur: aiomysql.Cursor) -> None:
         """Loads all privileges for users."""
 
-        self._cache.clear()
-
         # Grab all privileges from db.
         await cur.execute("SELECT id, privileges FROM users")
         privs_db = await cur.fetchall()
 
         # Save all to cache.
-        for u, priv in privs_db:
-            self._cache[u] = priv
+        self._cache = dict(privs_db)
 
     def get(self, user_id: int) -> Optional[int]:
         """Returns the privileges for the given user.
@@ -435,6 +432,11 @@ class PrivilegeCache:
 
         return self._cache.get(user_id)
 
+    def set(self, user_id: int, privileges: int) -> None:
+        """Sets the cached privileges for the given user."""
+
+        self._cache[user_id] = privileges
+
     async def cache_individual(self, user_id: int, cur: aiomysql.Cursor) -> int:
         """Caches an individual's privilege to cache. Meant for
         handling privilege updates.
@@ -444,10 +446,7 @@ class PrivilegeCache:
         """
 
         # Delete them if they already had a value cached.
-        try:
-            del self._cache[user_id]
-        except KeyError:
-            pass
+        self._cache.pop(user_id, None)
 
         # Grab their priv.
         await cur.execute(
@@ -481,15 +480,12 @@ class CountryCache:
     async def preload_all(self, cur: aiomysql.Cursor) -> None:
         """Loads all countries for users."""
 
-        self._cache.clear()
-
         # Grab all countries from db.
         await cur.execute("SELECT id, country FROM users_stats")
         countries_db = await cur.fetchall()
 
         # Save all to cache.
-        for u, country in countries_db:
-            self._cache[u] = country
+        self._cache = dict(countries_db)
 
     def get(self, user_id: int) -> Optional[str]:
         """Returns the country for the given user.
@@ -500,6 +496,11 @@ class CountryCache:
 
         return self._cache.get(user_id)
 
+    def set(self, user_id: int, country: str) -> None:
+        """Sets the cached country for the given user."""
+
+        self._cache[user_id] = country
+
     async def cache_individual(self, user_id: int, cur: aiomysql.Cursor) -> str:
         """Caches an individual's country to cache. Meant for
         handling privilege updates.
@@ -509,10 +510,7 @@ class CountryCache:
         """
 
         # Delete them if they already had a value cached.
-        try:
-            del self._cache[user_id]
-        except KeyError:
-            pass
+        self._cache.pop(user_id, None)
 
         # Grab their priv.
         await cur.execute(
@@ -536,20 +534,46 @@ class CountryCache:
 
 
 class FriendsCache:
-    """A cache for storing the friends list of users for quick lookups."""
+    """A cache for storing the friends list of users for quick lookups. Lists
+    expire after `cache_length` minutes, so friends added or removed on the
+    site show up on friends leaderboards without a restart."""
 
-    def __init__(self) -> None:
-        self._cache: dict[int, list[int]] = {}
+    def __init__(self, cache_length: int = 5, cache_limit: int = 100_000) -> None:
+        self._cache = LRUCache(cache_length=cache_length, cache_limit=cache_limit)
+
+    async def preload_all(self, cur: aiomysql.Cursor) -> None:
+        """Loads the friends lists of all users with any friends."""
+
+        # Grab all relationships from db.
+        await cur.execute("SELECT user1, user2 FROM users_relationships")
+        f_db = await cur.fetchall()
+
+        # Save all to cache. Users without friends are left to be filled in
+        # on their first lookup.
+        friends: dict[int, set[int]] = {}
+        for user_id, friend_id in f_db:
+            friends.setdefault(user_id, set()).add(friend_id)
+
+        for user_id, user_friends in friends.items():
+            self._cache.cache(user_id, user_friends)
 
-    def get(self, user_id: int) -> Optional[list[int]]:
-        """Returns the friends list for the given user.
+    def get(self, user_id: int) -> Optional[set[int]]:
+        """Returns the friends list for the given user, if cached and not
+        expired.
 
         Args:
             user_id (int): The user you want to grab the friends list for.
         """
 
+        # Sweep first, `LRUCache.get` alone would hand out expired lists.
+        self._cache.run_checks()
         return self._cache.get(user_id)
 
+    def set(self, user_id: int, friends: set[int]) -> None:
+        """Sets the cached friends list for the given user."""
+
+        self._cache.cache(user_id, friends)
+
     async def cache_individual(self, user_id: int, cur: aiomysql.Cursor) -> None:
         """Caches an individual's friend list to cache. Meant for
         handling friends list updates.
@@ -559,10 +583,7 @@ class FriendsCache:
         """
 
         # Delete them if they already had a value cached.
-        try:
-            del self._cache[user_id]
-        except KeyError:
-            pass
+        self._cache.remove_cache(user_id)
 
         # Grab their friends list.
         await cur.execute(
@@ -572,8 +593,8 @@ class FriendsCache:
 
         f_db = await cur.fetchall()
 
-        # cache their country.
-        self._cache[user_id] = f_db or [user_id]
+        # cache their friends.
+        self._cache.cache(user_id, {friend_id for (friend_id,) in f_db})
 
     @property
     def cached_count(self) -> int:
@@ -586,20 +607,21 @@ class WhitelistCache:
     """A cache for storing the whitelist status of users for quick lookups."""
 
     def __init__(self) -> None:
-        self._cache: dict[int, int] = {}
+        # Users whitelisted on vanilla (bit 1) and relax (bit 2), so a lookup
+        # is a single set membership check.
+        self._vanilla: set[int] = set()
+        self._relax: set[int] = set()
 
     async def preload_all(self, cur: aiomysql.Cursor) -> None:
         """Loads all whitelist status' for users."""
 
-        self._cache.clear()
-
         # Grab all whitelist status' from db.
-        await cur.execute("SELECT id, whitelist FROM users")
+        await cur.execute("SELECT id, whitelist FROM users WHERE whitelist != 0")
         w_db = await cur.fetchall()
 
         # Save all to cache.
-        for u, status in w_db:
-            self._cache[u] = status
+        self._vanilla = {u for u, status in w_db if status & 1}
+        self._relax = {u for u, status in w_db if status & 2}
 
     def get(self, user_id: int, relax: bool) -> bool:
         """Returns the whitelist status for the given user.
@@ -608,14 +630,7 @@ class WhitelistCache:
             user_id (int): The user you want to grab the whitelist status for.
         """
 
-        val = self._cache.get(user_id)
-        if not val:
-            return False
-
-        if not relax:
-            return val & 1 == 1
-        else:
-            return val & 2 == 2
+        return user_id in (self._relax if relax else self._vanilla)
 
     async def cache_individual(self, user_id: int, cur: aiomysql.Cursor) -> None:
         """Caches an individual's whitelist status to cache. Meant for
@@ -625,12 +640,6 @@ class WhitelistCache:
             user_id (int): The user for who to update the cached whitelist status for.
         """
 
-        # Delete them if they already had a value cached.
-        try:
-            del self._cache[user_id]
-        except KeyError:
-            pass
-
         # Grab their whitelist status.
         await cur.execute(
             "SELECT whitelist FROM users WHERE id = %s",
@@ -638,22 +647,29 @@ class WhitelistCache:
         )
 
         w_db = await cur.fetchone()
+        status = w_db[0] if w_db else 0
 
         # cache their status.
-        self._cache[user_id] = w_db
+        for whitelist, bit in ((self._vanilla, 1), (self._relax, 2)):
+            if status & bit:
+                whitelist.add(user_id)
+            else:
+                whitelist.discard(user_id)
 
     @property
     def cached_count(self) -> int:
-        """Number of tags cached."""
+        """Number of whitelisted users cached."""
 
-        return len(self._cache)
+        return len(self._vanilla | self._relax)
 
 
 class StatsCache:
     """A cache for storing the stats of users for quick lookups."""
 
     def __init__(self) -> None:
-        self._cache: dict[tuple[int, Mode], "Stats"] = {}
+        # Keyed by `user_id << 4 | mode` (modes fit in 4 bits), a plain int
+        # rather than a tuple built and hashed on every lookup.
+        self._cache: dict[int, "Stats"] = {}
 
     async def get(self, user_id: int, mode: Mode, cur: aiomysql.Cursor) -> "Stats":
         """Returns the stats for the given user.
@@ -662,55 +678,122 @@ class StatsCache:
             user_id (int): The user you want to grab the stats for.
         """
 
-        val = self._cache.get(
-            (
-                user_id,
-                mode,
-            )
-        )
+        val = self._cache.get(user_id << 4 | mode)
 
-        if val:
+        if val is not None:
             return val
 
-        await self.cache_individual(user_id, mode, cur)
-        val = self._cache.get(
-            (
-                user_id,
-                mode,
-            )
-        )
-        assert val is not None
-        return val
+        return await self.cache_individual(user_id, mode, cur)
 
     async def cache_individual(
         self, user_id: int, mode: Mode, cur: aiomysql.Cursor
-    ) -> None:
-        """Caches an individual's stats to cache. Meant for
+    ) -> "Stats":
+        """Caches an individual's stats to cache and returns them. Meant for
         handling stats updates.
 
         Args:
             user_id (int): The user for who to update the cached stats for.
         """
 
+        key = user_id << 4 | mode
+
         # Delete them if they already had a value cached.
-        try:
-            del self._cache[(user_id, mode)]
-        except KeyError:
-            pass
+        self._cache.pop(key, None)
 
         # Grab their stats.
         stats = await Stats.from_db(cur, user_id, mode)
 
         # cache their status.
-        self._cache[
-            (
-                user_id,
-                mode,
-            )
-        ] = stats
+        self._cache[key] = stats
+        return stats
 
     @property
     def cached_count(self) -> int:
         """Number of tags cached."""
 
         return len(self._cache)
+
+
+USERS_INFO_QUERY = (
+    "SELECT u.id, u.username, u.privileges, st.country FROM users u "
+    "LEFT JOIN users_stats st ON st.id = u.id WHERE u.id IN ({ids})"
+)
+USERS_INFO_CHUNK = 1000
+
+# username, privileges, country
+UserInfo = tuple[str, int, str]
+
+# Cached for ids with no `users` row, so they aren't queried on every request.
+_NO_USER: tuple = ()
+
+
+class UserInfoCache:
+    """A cache for storing the username, privileges and country of users shown
+    on leaderboards for quick lookups. Entries expire after `cache_length`
+    minutes."""
+
+    def __init__(self, cache_length: int = 5, cache_limit: int = 100_000) -> None:
+        self._cache = LRUCache(cache_length=cache_length, cache_limit=cache_limit)
+
+    def get(self, user_id: int) -> Optional[UserInfo]:
+        """Returns the cached info for the given user if it has not expired.
+
+        Args:
+            user_id (int): The user you want to grab the info for.
+        """
+
+        # Sweep first, `LRUCache.get` alone would hand out expired entries.
+        self._cache.run_checks()
+        info = self._cache.get(user_id)
+        if info is not _NO_USER:
+            return info
+
+    def remove(self, user_id: int) -> None:
+        """Removes the given user from the cache, forcing a refetch."""
+
+        self._cache.remove_cache(user_id)
+
+    async def get_many(
+        self, user_ids: set[int], cur: aiomysql.Cursor
+    ) -> dict[int, UserInfo]:
+        """Returns the info for all of `user_ids`, fetching every cache miss
+        in as few queries as possible. Users without a `users` row are left
+        out.
+
+        Args:
+            user_ids (set[int]): The users you want to grab the info for.
+        """
+
+        self._cache.run_checks()
+
+        users_info = {}
+        missing = []
+        for user_id in user_ids:
+            info = self._cache.get(user_id)
+            if info is None:
+                missing.append(user_id)
+            elif info is not _NO_USER:
+                users_info[user_id] = info
+
+        for idx in range(0, len(missing), USERS_INFO_CHUNK):
+            chunk = missing[idx : idx + USERS_INFO_CHUNK]
+            await cur.execute(
+                USERS_INFO_QUERY.format(ids=", ".join(("%s",) * len(chunk))), chunk
+            )
+
+            for user_id, username, priv, country in await cur.fetchall():
+                info = (username, priv, country)
+                users_info[user_id] = info
+                self._cache.cache(user_id, info)
+
+            for user_id in chunk:
+                if user_id not in users_info:
+                    self._cache.cache(user_id, _NO_USER)
+
+        return users_info
+
+    @property
+    def cached_count(self) -> int:
+        """Number of users cached."""
+
+        return len(self._cache)
@@ -1,3 +1,4 @@
+from bisect import bisect_right
 from dataclasses import dataclass
 from dataclasses import field
 from typing import Optional
@@ -6,8 +7,6 @@ from typing import TypedDict
 import aiomysql
 
 from const import FetchResult
-from const import MAP_FILENAME
-from const import MapResult
 from const import Mode
 from objects.beatmap import LWBeatmap
 from objects.beatmap import try_bmap
@@ -27,18 +26,12 @@ SELECT
     s.full_combo,
     s.mods,
     s.time,
-    a.username,
-    a.id,
+    s.userid,
     s.pp,
-    st.country,
     s.score,
     s.accuracy
 FROM
     {table} s
-INNER JOIN
-    users a on s.userid = a.id
-INNER JOIN
-    users_stats st on s.userid = st.id
 WHERE
     {where_clauses}
 """
@@ -50,6 +43,16 @@ INNER JOIN
 WHERE {where_clauses}
 """
 
+# Only the table and scoring column vary per mode, so build them all upfront.
+LEADERBOARD_QUERIES = {
+    mode: BASE_QUERY.format(
+        scoring="pp" if mode.relax or mode.autopilot else "score",
+        table=mode.scores_table,
+        where_clauses="s.beatmap_md5 = %s AND s.play_mode = %s AND s.completed = 3",
+    )
+    for mode in Mode
+}
+
 MAX_SCORES = 500
 # Structures held in cache.
 
@@ -67,26 +70,51 @@ class Leaderboard:
     lb_fetch: FetchResult
     scores: list[Score] = field(default_factory=list)
 
+    # user_id/score id: index in `scores`, built on first lookup after any change.
+    _user_index: Optional[dict[int, int]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _id_index: Optional[dict[int, int]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    # Negated sort value of each score in `scores`, ascending so it can be
+    # bisected to insert a new score in place.
+    _keys: list[float] = field(
+        default_factory=list, init=False, repr=False, compare=False
+    )
+
     def __len__(self) -> int:
         return len(self.scores)
 
     def remove_score_index(self, index: int) -> None:
         self.scores.pop(index)
+        self._keys.pop(index)
+        self._user_index = self._id_index = None
 
-    def find_user_score(self, user_id: int) -> Optional[UserScore]:
+    def _build_indexes(self) -> None:
+        self._user_index = {}
+        self._id_index = {}
         for idx, score in enumerate(self.scores):
-            if score.user_id == user_id:
-                return {
-                    "score": score,
-                    "rank": idx + 1,
-                }
+            self._user_index.setdefault(score.user_id, idx)  # keep the best
+            self._id_index[score.id] = idx
+
+    def find_user_score(self, user_id: int) -> Optional[UserScore]:
+        if self._user_index is None:
+            self._build_indexes()
+
+        idx = self._user_index.get(user_id)
+        if idx is not None:
+            return {
+                "score": self.scores[idx],
+                "rank": idx + 1,
+            }
 
     def find_score_rank(self, score_id: int) -> int:
-        for idx, score in enumerate(self.scores):
-            if score.id == score_id:
-                return idx + 1
+        if self._id_index is None:
+            self._build_indexes()
 
-        return 0
+        idx = self._id_index.get(score_id)
+        return 0 if idx is None else idx + 1
 
     def remove_user(self, user_id: int) -> None:
         result = self.find_user_score(user_id)
@@ -94,20 +122,24 @@ class Leaderboard:
         if result is not None:
             self.remove_score_index(result["rank"] - 1)
 
-    def sort(self) -> None:
-        if self.mode > Mode.VN_MANIA:
-            sort = lambda score: score.pp
-        else:
-            sort = lambda score: score.score
+    def _sort_key(self, score: Score) -> float:
+        return -(score.pp if self.mode > Mode.VN_MANIA else score.score)
 
-        self.scores = sorted(self.scores, key=sort, reverse=True)
+    def sort(self) -> None:
+        self.scores = sorted(self.scores, key=self._sort_key)
+        self._keys = [self._sort_key(score) for score in self.scores]
+        self._user_index = self._id_index = None
 
     def add_score(self, score: Score) -> None:
         assert score.user_id is not None
         self.remove_user(score.user_id)
 
-        self.scores.append(score)
-        self.sort()
+        # The list is already sorted, so just insert after any equal scores.
+        key = self._sort_key(score)
+        idx = bisect_right(self._keys, key)
+        self._keys.insert(idx, key)
+        self.scores.insert(idx, score)
+        self._user_index = self._id_index = None
 
     @classmethod
     async def from_db(
@@ -115,66 +147,30 @@ class Leaderboard:
         cur: aiomysql.Cursor,
         md5: str,
         mode: Mode,
-        filename: str,
     ) -> Optional["Leaderboard"]:
         """Attempts to fetch the leaderboard from MySQL."""
 
         bmap_res, bmap = await try_bmap(md5, cur)  # type: ignore
         bmap: LWBeatmap
-        if (
-            bmap_res is FetchResult.NONE
-        ):  # check if map is unsubmitted or needs updating
-            regexed_name = MAP_FILENAME.match(
-                filename
-            )  # XXX: maybe should cache this in db, have a check or something?
-            if regexed_name:
-                formatted_name = f"{regexed_name['artist']} - {regexed_name['title']} [{regexed_name['diff']}]"
-            else:
-                return None
-                return MapResult.UNSUBMITTED
-
-            try:
-                await cur.execute(
-                    "SELECT 1 FROM beatmaps WHERE song_name = %s", [formatted_name]
-                )
-                db_result = await cur.fetchone()
-
-                if db_result:
-                    return None
-                    return MapResult.UPDATE_REQUIRED
-                else:
-                    return None
-                    return MapResult.UNSUBMITTED
-            except Exception:  # collation, we will assume update required
-                return None
-                return MapResult.UPDATE_REQUIRED
-
-        where_clauses = [
-            "s.beatmap_md5 = %s",
-            "s.play_mode = %s",
-            "s.completed = 3",
-        ]
-        where_args = [
-            bmap.md5,
-            mode.as_mode_int(),
-        ]
-
-        where_clauses_str = " AND ".join(where_clauses)
-
-        table = mode.scores_table
-        scoring = "pp" if mode.relax or mode.autopilot else "score"
-
-        query = BASE_QUERY.format(
-            scoring=scoring, table=table, where_clauses=where_clauses_str
-        )
-
-        await cur.execute(query, where_args)
-        scores_db = await cur.fetchall()
+        # Unsubmitted and outdated maps are already told apart by `try_bmap`
+        # (and remembered in `no_check_md5s`), there's no leaderboard for either.
+        if bmap_res is FetchResult.NONE:
+            return None
+
+        # Stream the rows on the same connection so the whole result set is
+        # never held next to the scores built from it.
+        scores = []
+        async with cur.connection.cursor(aiomysql.SSCursor) as ss_cur:
+            await ss_cur.execute(
+                LEADERBOARD_QUERIES[mode], (bmap.md5, mode.as_mode_int())
+            )
+            while batch := await ss_cur.fetchmany(256):
+                scores.extend(Score.from_lb_row(score, bmap, mode) for score in batch)
 
         # Create final object.
         lb = Leaderboard(
             mode=mode,
-            scores=[Score.from_lb_row(score, bmap, mode) for score in scores_db],
+            scores=scores,
             lb_fetch=FetchResult.MYSQL,
         )
 
@@ -183,13 +179,13 @@ class Leaderboard:
 
     @classmethod
     async def get_leaderboard(
-        cls, beatmap: LWBeatmap, cur: aiomysql.Cursor, filename: str, mode: Mode
+        cls, beatmap: LWBeatmap, cur: aiomysql.Cursor, mode: Mode
     ) -> Optional["Leaderboard"]:
         if lb := beatmap.leaderboard.get(mode):
             lb.lb_fetch = FetchResult.CACHE
             return lb
 
-        lb = await Leaderboard.from_db(cur, beatmap.md5, mode, filename)
+        lb = await Leaderboard.from_db(cur, beatmap.md5, mode)
         if lb is not None:
             beatmap.leaderboard[mode] = lb
 
@@ -1,21 +1,66 @@
+import asyncio
 import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+from typing import NamedTuple
 
-from aiohttp import ClientSession
 from cmyui.osu.oppai_ng import OppaiWrapper
 from peace_performance_python import Beatmap
 from peace_performance_python import Calculator
 from rosu_pp_py import Calculator as RCalculator
 from rosu_pp_py import ScoreParams
 
+from globs import cache
+from globs.conn import conns
+from logger import error
+
+# The calculators are all synchronous CPU work, so they run in worker
+# processes rather than blocking the event loop. Each worker keeps its own
+# `cache.pp_map`. They are spawned rather than forked, as by the time the
+# first score comes in the server process already has threads running.
+_PP_CONTEXT = multiprocessing.get_context("spawn")
+_PP_POOL = ProcessPoolExecutor(mp_context=_PP_CONTEXT)
+
+# map id: in-progress .osu download, shared by concurrent calculations on it.
+_MAP_DOWNLOADS: dict[int, asyncio.Task] = {}
+
+
+class CalcParams(NamedTuple):
+    """The parts of a score the calculators need, small enough to send to
+    the worker processes."""
+
+    map_id: int
+    mode: int
+    mods: int
+    acc: float
+    miss: int
+    score: int
+    combo: int
+
+
+def _parsed_map(key: tuple, map_path: str, parse) -> object:
+    """Returns the calculator's parsed form of the map at `map_path`, only
+    parsing it again if the file changed since it was cached."""
+
+    mtime = os.stat(map_path).st_mtime_ns
+    cached = cache.pp_map.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    parsed = parse(map_path)
+    cache.pp_map.cache(key, (mtime, parsed))
+    return parsed
+
 
 class RosuCalculator:  # wrapper around peace performance for ease of use
-    def __init__(self, score) -> None:
+    def __init__(self, score: CalcParams) -> None:
         self.score = score
-        self.map = score.map
 
     def calculate(self, map_path: str) -> tuple[float]:
-        calculator = RCalculator(map_path)
+        calculator = _parsed_map(("rosu", self.score.map_id), map_path, RCalculator)
         params = ScoreParams(
             acc=self.score.acc,
             nMisses=self.score.miss,
@@ -29,18 +74,17 @@ class RosuCalculator:  # wrapper around peace performance for ease of use
 
 
 class PeaceCalculator:
-    def __init__(self, score) -> None:
+    def __init__(self, score: CalcParams) -> None:
         self.score = score
-        self.map = score.map
 
     def calculate(self, map_path: str) -> tuple[float]:
-        beatmap = Beatmap(map_path)
+        beatmap = _parsed_map(("peace", self.score.map_id), map_path, Beatmap)
         calculator = Calculator(
             acc=self.score.acc,
             miss=self.score.miss,
             score=self.score.score,
             combo=self.score.combo,
-            mode=self.score.mode.as_mode_int(),
+            mode=self.score.mode,
             mods=self.score.mods,
         )
 
@@ -49,14 +93,13 @@ class PeaceCalculator:
 
 
 class OppaiCalculator:  # wrapper around oppaiwrapper for ease of use
-    def __init__(self, score) -> None:
+    def __init__(self, score: CalcParams) -> None:
         self.score = score
-        self.map = score.map
 
     def calculate(self, map_path: str) -> tuple[float]:
         with OppaiWrapper("oppai-ng/liboppai.so") as calculator:
             calculator.configure(
-                mode=self.score.mode.as_mode_int(),
+                mode=self.score.mode,
                 acc=self.score.acc,
                 mods=self.score.mods,
                 combo=self.score.combo,
@@ -69,6 +112,60 @@ class OppaiCalculator:  # wrapper around oppaiwrapper for ease of use
             return (pp, sr)
 
 
+async def _download_map(map_id: int, map_path: Path) -> None:
+    async with conns.http.get(f"https://old.ppy.sh/osu/{map_id}", timeout=10) as resp:
+        map_file = await resp.read()
+
+    # Off the event loop, the calculation waits for it anyway.
+    await asyncio.to_thread(map_path.write_bytes, map_file)
+
+
+def _rebuild_pp_pool(broken: ProcessPoolExecutor) -> None:
+    """Replaces the pool after one of its workers died, as a broken pool
+    rejects everything sent to it afterwards."""
+
+    global _PP_POOL
+
+    # Concurrent calculations all see the same pool break, only replace it once.
+    if _PP_POOL is broken:
+        _PP_POOL = ProcessPoolExecutor(mp_context=_PP_CONTEXT)
+        broken.shutdown(wait=False)
+
+
+def shutdown_pp_pool() -> None:
+    """Stops the pp calculation workers."""
+
+    _PP_POOL.shutdown(wait=False, cancel_futures=True)
+
+
+async def _run_in_pool(calc, params: CalcParams, map_path: str) -> tuple[float]:
+    """Runs `_calculate` in the worker pool, retrying once on a fresh pool
+    if the current one is broken."""
+
+    for attempt in range(2):
+        pool = _PP_POOL
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                pool, _calculate, calc, params, map_path
+            )
+        except BrokenProcessPool:
+            error(
+                f"PP calculation pool broke calculating map {params.map_id}, "
+                "rebuilding it.",
+            )
+            _rebuild_pp_pool(pool)
+
+    # Not calculated inline as a last resort, whatever is killing the workers
+    # (a calculator crashing on this map) would take the server down with it.
+    raise BrokenProcessPool(f"PP calculation on map {params.map_id} kept failing.")
+
+
+def _calculate(calc, params: CalcParams, map_path: str) -> tuple[float]:
+    """Ran in the worker processes, `calc` is one of the calculator classes."""
+
+    return calc(params).calculate(map_path)
+
+
 class PPUtils:
     def __init__(self, score, calc) -> None:
         self.score = score
@@ -95,15 +192,33 @@ class PPUtils:
         return self
 
     async def calculate(self) -> tuple[float]:
-        map_path = Path(f"/home/akatsuki/lets/.data/beatmaps/{self.map.id}.osu")  # lol
-        if not map_path.exists():
-            async with ClientSession() as sesh:
-                async with sesh.get(f"https://old.ppy.sh/osu/{self.map.id}") as resp:
-                    map_file = await resp.read()
-                    map_path.write_bytes(map_file)
+        map_id = self.map.id
+        map_path = Path(f"/home/akatsuki/lets/.data/beatmaps/{map_id}.osu")  # lol
+
+        # An in-progress download is waited on even if the file exists, as it
+        # may still be being written.
+        download = _MAP_DOWNLOADS.get(map_id)
+        if download is None and not map_path.exists():
+            download = asyncio.create_task(_download_map(map_id, map_path))
+            download.add_done_callback(lambda _: _MAP_DOWNLOADS.pop(map_id, None))
+            _MAP_DOWNLOADS[map_id] = download
+
+        if download is not None:
+            # Shielded so one submission going away doesn't cancel it for the others.
+            await asyncio.shield(download)
+
+        params = CalcParams(
+            map_id=map_id,
+            mode=self.score.mode.as_mode_int(),
+            mods=self.score.mods,
+            acc=self.score.acc,
+            miss=self.score.miss,
+            score=self.score.score,
+            combo=self.score.combo,
+        )
 
         try:
-            pp, sr = self.calc(self.score).calculate(str(map_path))
+            pp, sr = await _run_in_pool(self.calc, params, str(map_path))
         except:
             pp, sr = 0, 0  # shouldn't really occur
 
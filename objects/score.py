@@ -1,11 +1,12 @@
 import base64
 import time
+from functools import lru_cache
+from operator import itemgetter
 from typing import Optional
 from typing import TYPE_CHECKING
 from urllib.parse import urlencode
 
 import aiomysql
-from aiohttp import ClientSession
 from py3rijndael import RijndaelCbc
 from py3rijndael import ZeroPadding
 
@@ -15,6 +16,9 @@ from .pp import PPUtils
 from config import conf
 from const import Mode
 from globs import cache
+from globs.conn import conns
+from helpers.tasks import run_in_background
+from helpers.user import safe_name
 from logger import info
 
 if TYPE_CHECKING:
@@ -33,7 +37,107 @@ WHERE
 """
 
 
+# The submission fields that have to be non-negative ints, pulled out as a
+# tuple in one go rather than slicing and concatenating the list per submit.
+_INT_FIELDS = itemgetter(3, 4, 5, 6, 7, 8, 9, 10, 13, 15, 16)
+
+
+def _std_acc(score: "Score") -> float:
+    hits = score.n300 + score.n100 + score.n50 + score.miss
+    if hits == 0:
+        return 0.0
+
+    return (
+        100.0
+        * ((score.n50 * 50.0) + (score.n100 * 100.0) + (score.n300 * 300.0))
+        / (hits * 300.0)
+    )
+
+
+def _taiko_acc(score: "Score") -> float:
+    hits = score.n300 + score.n100 + score.miss
+    if hits == 0:
+        return 0.0
+
+    return 100.0 * ((score.n100 * 0.5) + score.n300) / hits
+
+
+def _catch_acc(score: "Score") -> float:
+    hits = score.n300 + score.n100 + score.n50 + score.katu + score.miss
+    if hits == 0:
+        return 0.0
+
+    return 100.0 * (score.n300 + score.n100 + score.n50) / hits
+
+
+def _mania_acc(score: "Score") -> float:
+    hits = score.n300 + score.n100 + score.n50 + score.geki + score.katu + score.miss
+    if hits == 0:
+        return 0.0
+
+    return (
+        100.0
+        * (
+            (score.n50 * 50.0)
+            + (score.n100 * 100.0)
+            + (score.katu * 200.0)
+            + ((score.n300 + score.geki) * 300.0)
+        )
+        / (hits * 300.0)
+    )
+
+
+# Indexed by mode int, rather than walking an if chain per submission.
+_ACC_CALCS = (_std_acc, _taiko_acc, _catch_acc, _mania_acc)
+
+
+@lru_cache(maxsize=16)
+def _score_cipher(osuver: str) -> RijndaelCbc:
+    """Returns the score cipher for the client version, so its key schedule
+    is only expanded once. The iv is set on it per submission."""
+
+    return RijndaelCbc(
+        key=("osu!-scoreburgr---------" + osuver).encode(),
+        iv=bytes(32),
+        padding=ZeroPadding(32),
+        block_size=32,
+    )
+
+
 class Score:
+    # Leaderboards keep every score of a map in memory, skip the per instance dict.
+    __slots__ = (
+        "id",
+        "user_id",
+        "user_name_real",
+        "user_name",
+        "score",
+        "combo",
+        "mods",
+        "n300",
+        "n100",
+        "n50",
+        "katu",
+        "geki",
+        "miss",
+        "time",
+        "mode",
+        "status",
+        "acc",
+        "pp",
+        "sr",
+        "checksum",
+        "map",
+        "previous_score",
+        "fc",
+        "passed",
+        "quit",
+        "grade",
+        "using_patcher",
+        "rank",
+        "lb_fmt",
+    )
+
     def __init__(self) -> None:
         self.id = None
         self.user_id = None
@@ -53,6 +157,7 @@ class Score:
         self.status = None
         self.acc = None
         self.pp = None
+        self.sr = None
         self.checksum = None
         self.map = None
         self.previous_score = None
@@ -62,6 +167,8 @@ class Score:
         self.grade = None
         self.using_patcher = None
         self.rank = None
+        # Rank/name independent parts of the leaderboard row, see handlers.
+        self.lb_fmt = None
 
     @staticmethod
     async def from_score_submission(
@@ -69,21 +176,19 @@ class Score:
     ) -> Optional["Score"]:
         """Creates a score object from an osu! submission request"""
 
-        aes = RijndaelCbc(
-            key=("osu!-scoreburgr---------" + args["osuver"]).encode(),
-            iv=base64.b64decode(args["iv"]),
-            padding=ZeroPadding(32),
-            block_size=32,
-        )
+        # Shared between submissions, safe as nothing awaits between setting
+        # the iv and decrypting.
+        aes = _score_cipher(args["osuver"])
+        aes.iv = base64.b64decode(args["iv"])
 
-        data = (
-            aes.decrypt(base64.b64decode(args.getlist("score")[0])).decode().split(":")
-        )
+        # Split as bytes, only the text fields get decoded and `int()` takes
+        # the rest as they are.
+        data = aes.decrypt(base64.b64decode(args.getlist("score")[0])).split(b":")
 
         score = Score()
 
-        score.user_name_real = data[1]
-        score.user_name = data[1].rstrip().lower().replace(" ", "_")
+        score.user_name_real = data[1].decode()
+        score.user_name = safe_name(score.user_name_real)
         score.user_id = await cache.password.check_user(
             score.user_name, args["pass"], cur
         )
@@ -94,7 +199,7 @@ class Score:
             # TODO: should this really return the score? or should it be None?
             return score
 
-        score.map = (await try_bmap(data[0], cur))[1]
+        score.map = (await try_bmap(data[0].decode(), cur))[1]
         if not score.map:
             return score
 
@@ -102,9 +207,9 @@ class Score:
             info(f"Received invalid score submission from {score.user_name}.")
             return None
 
-        score.checksum = data[2]
+        score.checksum = data[2].decode()
 
-        if not all(map(str.isdecimal, data[3:11] + [data[13], data[15], data[16]])):
+        if not all(map(bytes.isdigit, _INT_FIELDS(data))):
             info(f"Received an invalid score submission from {score.user_name}")
             return None
 
@@ -119,10 +224,10 @@ class Score:
             score.combo,
         ) = map(int, data[3:11])
 
-        score.fc = data[11] == "True"
-        score.passed = data[14] == "True"
+        score.fc = data[11] == b"True"
+        score.passed = data[14] == b"True"
         score.quit = args.get("x") == "1"
-        score.grade = data[12] if score.passed else "F"
+        score.grade = data[12].decode() if score.passed else "F"
 
         score.mods = int(data[13])
         mode = int(data[15])
@@ -173,21 +278,26 @@ class Score:
     def from_lb_row(sql_row: tuple, beatmap: LWBeatmap, mode: Mode) -> "Score":
         score = Score()
 
-        score.id = sql_row[0]
-        score.combo = sql_row[2]
-        score.n50 = sql_row[3]
-        score.n100 = sql_row[4]
-        score.n300 = sql_row[5]
-        score.miss = sql_row[6]
-        score.katu = sql_row[7]
-        score.geki = sql_row[8]
-        score.fc = sql_row[9]
-        score.mods = sql_row[10]
-        score.time = sql_row[11]
-        score.user_id = sql_row[13]
-        score.pp = sql_row[14]
-        score.score = sql_row[16]
-        score.acc = sql_row[17]
+        # Unpacked in one go rather than indexing the row per column, see
+        # `BASE_QUERY` in leaderboards for the order.
+        (
+            score.id,
+            _,  # the scoring column, pp or score
+            score.combo,
+            score.n50,
+            score.n100,
+            score.n300,
+            score.miss,
+            score.katu,
+            score.geki,
+            score.fc,
+            score.mods,
+            score.time,
+            score.user_id,
+            score.pp,
+            score.score,
+            score.acc,
+        ) = sql_row
 
         score.mode = mode
         score.map = beatmap
@@ -195,52 +305,7 @@ class Score:
         return score
 
     def calc_accuracy(self) -> None:
-        mode = self.mode.as_mode_int()
-        if mode == 0:
-            hits = self.n300 + self.n100 + self.n50 + self.miss
-
-            if hits == 0:
-                self.acc = 0.0
-                return
-            else:
-                self.acc = (
-                    100.0
-                    * ((self.n50 * 50.0) + (self.n100 * 100.0) + (self.n300 * 300.0))
-                    / (hits * 300.0)
-                )
-        elif mode == 1:
-            hits = self.n300 + self.n100 + self.miss
-
-            if hits == 0:
-                self.acc = 0.0
-                return
-            else:
-                self.acc = 100.0 * ((self.n100 * 0.5) + self.n300) / hits
-        elif mode == 2:
-            hits = self.n300 + self.n100 + self.n50 + self.katu + self.miss
-
-            if hits == 0:
-                self.acc = 0.0
-                return
-            else:
-                self.acc = 100.0 * (self.n300 + self.n100 + self.n50) / hits
-        elif mode == 3:
-            hits = self.n300 + self.n100 + self.n50 + self.geki + self.katu + self.miss
-
-            if hits == 0:
-                self.acc = 0.0
-                return
-            else:
-                self.acc = (
-                    100.0
-                    * (
-                        (self.n50 * 50.0)
-                        + (self.n100 * 100.0)
-                        + (self.katu * 200.0)
-                        + ((self.n300 + self.geki) * 300.0)
-                    )
-                    / (hits * 300.0)
-                )
+        self.acc = _ACC_CALCS[self.mode.as_mode_int()](self)
 
     async def calc_pp(self) -> None:
         if self.mode.value == 0:  # std-vn
@@ -271,12 +336,14 @@ class Score:
             self.map.md5,
         )
 
-        await cur.execute(
-            f"UPDATE {table} SET completed = 2 WHERE "
-            + query
-            + f" AND pp < {self.pp} LIMIT 1",
-            args,
-        )
+        # If this demoted a previous best, this one is the new best and there's
+        # no need to look for another.
+        if await cur.execute(
+            f"UPDATE {table} SET completed = 2 WHERE " + query + " AND pp < %s LIMIT 1",
+            args + (self.pp,),
+        ):
+            self.status = 3
+            return
 
         await cur.execute(f"SELECT 1 FROM {table} WHERE " + query + " LIMIT 1", args)
         prev = await cur.fetchone()
@@ -288,28 +355,25 @@ class Score:
         self.status = 2
 
     async def first_place(self, cur: aiomysql.Cursor) -> None:
+        rx = 1 if self.mode.relax else (2 if self.mode.autopilot else 0)
+
         await cur.execute(
             "DELETE FROM scores_first WHERE beatmap_md5 = %s AND mode = %s AND rx = %s",
-            (
-                self.map.md5,
-                self.mode.as_mode_int(),
-                1 if self.mode.relax else (2 if self.mode.autopilot else 0),
-            ),
+            (self.map.md5, self.mode.as_mode_int(), rx),
         )
 
         await cur.execute(
             "INSERT INTO scores_first (beatmap_md5, mode, rx, scoreid, userid) "
             "VALUES (%s, %s, %s, %s, %s)",
-            (
-                self.map.md5,
-                self.mode.as_mode_int(),
-                1 if self.mode.relax else (2 if self.mode.autopilot else 0),
-                self.id,
-                self.user_id,
-            ),
+            (self.map.md5, self.mode.as_mode_int(), rx, self.id, self.user_id),
         )
 
-        # announce #1 ingame
+        # The submission doesn't depend on pep.py, so don't make it wait on it.
+        run_in_background(self.announce_first_place())
+
+    async def announce_first_place(self) -> None:
+        """Announces the #1 ingame through pep.py."""
+
         # TODO: check if score is highest pp play for that mode, and change announce msg if so
         profile_embed = f"[https://akatsuki.pw/u/{self.user_id} {self.user_name_real}]"
         ann_msg = f"[{'R' if self.mode.relax else ('V' if not self.mode.autopilot else 'A')}] {profile_embed} achieved rank #1 on {self.map.embed} ({self.mode.annouce_prefix}) - {self.pp:.2f}pp"
@@ -317,10 +381,10 @@ class Score:
         # send request to pep.py
         params = urlencode({"k": conf.fokabot_key, "to": "#announce", "msg": ann_msg})
 
-        async with ClientSession() as sesh:
-            await sesh.get(
-                f"http://localhost:5001/api/v1/fokabotMessage?{params}", timeout=2
-            )
+        async with conns.http.get(
+            f"http://localhost:5001/api/v1/fokabotMessage?{params}", timeout=2
+        ):
+            pass
 
     async def submit(self, cur: aiomysql.Cursor) -> None:
         table = self.mode.scores_table
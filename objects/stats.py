@@ -6,6 +6,11 @@ from const import Mode
 from globs import cache
 from globs.conn import conns
 
+# The decaying weights for the top plays, they never change so are built once.
+PP_WEIGHTS = tuple(0.95**idx for idx in range(125))
+ACC_WEIGHTS = tuple(int((0.95**idx) * 100) for idx in range(500))
+ACC_DIVIDERS = tuple(sum(ACC_WEIGHTS[:count]) for count in range(501))
+
 
 @dataclass
 class Stats:
@@ -58,10 +63,10 @@ class Stats:
 
         country = cache.country.get(self.user_id)
 
-        await conns.redis.zadd(f"ripple:{board}:{mode}", self.pp, self.user_id)
+        await conns.redis.zadd(f"ripple:{board}:{mode}", {self.user_id: self.pp})
         if country and country.lower() != "xx":
             await conns.redis.zadd(
-                f"ripple:{board}:{mode}:{country.lower()}", self.pp, self.user_id
+                f"ripple:{board}:{mode}:{country.lower()}", {self.user_id: self.pp}
             )
 
         await self.refresh_stats()
@@ -95,39 +100,41 @@ class Stats:
         # total_pp = self.pp
         play_mode = self.mode.as_mode_int()
 
+        sortby = "pp"
+        if play_mode != 0:
+            sortby = "accuracy"
+
+        # Both the top plays for pp and for accuracy in one round trip, told
+        # apart by `src` and kept in their own order by `sortval`.
         # if not self._recalc_pp or (score_pp and score_pp > self._recalc_pp):
         await cur.execute(
-            f"SELECT s.pp FROM {table} s RIGHT JOIN beatmaps b USING(beatmap_md5) "
+            f"(SELECT 0 src, s.pp sortval, s.pp val FROM {table} s "
+            "RIGHT JOIN beatmaps b USING(beatmap_md5) "
             "WHERE s.completed = 3 AND s.play_mode = %s AND b.ranked in (3, 2) AND s.userid = %s "
             "AND pp IS NOT NULL "
-            "ORDER BY s.pp DESC LIMIT 125",
-            (play_mode, self.user_id),
+            "ORDER BY s.pp DESC LIMIT 125) "
+            f"UNION ALL (SELECT 1, {sortby}, accuracy FROM {table} "
+            "WHERE userid = %s AND play_mode = %s AND completed = 3 "
+            f"ORDER BY {sortby} DESC LIMIT 500) "
+            "ORDER BY src, sortval DESC",
+            (play_mode, self.user_id, self.user_id, play_mode),
         )
-        scores_pp = await cur.fetchall()
-
-        total_pp = 0
-        for idx_pp, pp in enumerate(scores_pp):
-            total_pp += round(round(pp[0]) * 0.95**idx_pp)
+        scores_pp = []
+        scores_acc = []
+        for src, _, val in await cur.fetchall():
+            (scores_acc if src else scores_pp).append(val)
 
-            # if idx_pp == 124:
-            #   self._recalc_pp = pp[0]
-
-        sortby = "pp"
-        if play_mode != 0:
-            sortby = "accuracy"
-        await cur.execute(
-            f"SELECT accuracy FROM {table} WHERE userid = %s AND play_mode = %s AND completed = 3 ORDER BY {sortby} DESC LIMIT 500",
-            (self.user_id, play_mode),
+        total_pp = sum(
+            round(round(pp) * weight) for pp, weight in zip(scores_pp, PP_WEIGHTS)
         )
-        scores_acc = await cur.fetchall()
+        # if len(scores_pp) == 125:
+        #   self._recalc_pp = scores_pp[-1]
 
-        total_acc = 0.0
-        divider = 0.0
         try:
-            for idx, acc in enumerate(scores_acc):
-                total_acc += acc[0] * int((0.95**idx) * 100)
-                divider += int((0.95**idx) * 100)
-            self.accuracy = total_acc / divider
+            total_acc = sum(
+                acc * weight for acc, weight in zip(scores_acc, ACC_WEIGHTS)
+            )
+            self.accuracy = total_acc / ACC_DIVIDERS[len(scores_acc)]
         except Exception as e:
             print(e)
             self.accuracy = 0.0
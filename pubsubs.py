@@ -3,9 +3,9 @@ import asyncio
 import traceback
 from typing import Callable
 
-from aioredis import Channel
+from redis.asyncio.client import PubSub
 
-from const import Status
+from const import STATUS_BY_VAL
 from globs.cache import beatmap
 from globs.conn import conns
 from logger import error
@@ -14,30 +14,38 @@ from logger import info
 REDIS_LOCK = asyncio.Lock()
 
 
-async def wait_for_pub(ch: Channel, h: Callable) -> None:
+async def wait_for_pub(ch: PubSub, handlers: dict[bytes, Callable]) -> None:
     """A permanently looping task waiting for the call of a `publish` redis
     event, calling its respective handler upon recevial. Meant to be ran as
     a task.
 
     Args:
-        ch (Channel): The publish channel to listen and read from.
-        h (Callable): The async
+        ch (PubSub): The subscribed pubsub to listen and read from.
+        handlers (dict[bytes, Callable]): The async handlers by channel name.
     """
 
-    async for msg in ch.iter():
+    async for msg in ch.listen():
+        # Skip the subscribe confirmations etc.
+        if msg["type"] != "message":
+            continue
+
         try:
-            await h(msg)
+            await handlers[msg["channel"]](msg["data"])
         except Exception:
             error("Exception occured while handling pubsub! " + traceback.format_exc())
 
 
-async def pubsub_executor(name: str, h: Callable) -> None:
-    """Creates an loop task listening to a redis channel with the name `name`
-    upon creating it, listening to `publish` events. Upon receival, calls `h`.
+async def pubsub_executor(handlers: dict[str, Callable]) -> None:
+    """Creates an loop task listening to all of the redis channels in
+    `handlers` over a single connection, listening to `publish` events. Upon
+    receival, calls the channel's handler.
     """
 
-    (ch,) = await conns.redis.subscribe(name)
-    asyncio.get_running_loop().create_task(wait_for_pub(ch, h))
+    ch = conns.redis.pubsub()
+    await ch.subscribe(*handlers)
+    asyncio.get_running_loop().create_task(
+        wait_for_pub(ch, {name.encode(): h for name, h in handlers.items()})
+    )
 
 
 async def handle_status_update(msg) -> None:
@@ -46,5 +54,5 @@ async def handle_status_update(msg) -> None:
     beatmap.remove_cache(md5)
 
     info(
-        f"Received status update on beatmap {md5} with new status {Status(int(new_status))!r}"
+        f"Received status update on beatmap {md5} with new status {STATUS_BY_VAL[int(new_status)]!r}"
     )